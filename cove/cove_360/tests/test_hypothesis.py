@@ -1,4 +1,11 @@
-from lib360dataquality.cove.threesixtygiving import get_grants_aggregates
+import datetime
+from collections import OrderedDict
+
+from lib360dataquality.cove.threesixtygiving import (
+    get_grants_aggregates, convert_string_date_to_datetime, DateError, email_paths, flatten_dict, compiled_email_re,
+    repeated_values,
+)
+from lib360dataquality.check_field_present import compile_field_path
 from hypothesis import HealthCheck, given, assume, settings, strategies as st
 import pytest
 
@@ -26,3 +33,82 @@ def test_get_grants_aggregates(json_data):
 def test_get_grants_aggregates_dict(json_data):
     assume(type(json_data) is dict)
     get_grants_aggregates(json_data)
+
+
+date_strings = st.one_of(
+    st.text(),
+    st.dates().map(str),
+    st.from_regex(r"\A\d{4}-\d{1,2}-\d{1,3}(T.*)?\Z"),
+)
+
+
+@given(date_strings)
+def test_convert_string_date_to_datetime(input_date):
+    # test oracle: the same as strptime
+    try:
+        expected = datetime.datetime.strptime(input_date.split("T")[0], "%Y-%m-%d")
+    except ValueError:
+        expected = None
+
+    datetime_date, error = convert_string_date_to_datetime(input_date)
+    assert datetime_date == expected
+    assert (error is None) == (expected is not None)
+    assert error in (None, DateError.BAD_FORMAT, DateError.OUT_OF_RANGE, DateError.TRAILING_DATA)
+
+
+# Keys without "/" so that each path is only in the flattened grant once
+grant_json = st.recursive(
+    st.integers() | st.text() | st.none() | st.sampled_from(["me@example.com", "a@b", "Contact: x.y@z.org.uk", "@"]),
+    lambda children: st.lists(children) | st.dictionaries(
+        st.text(alphabet=st.characters(blacklist_characters="/")) | st.sampled_from(["email", "contactEmail", "name"]),
+        children,
+        max_size=5,
+    ),
+    max_leaves=20,
+)
+
+
+@given(st.dictionaries(st.text(alphabet=st.characters(blacklist_characters="/")), grant_json, max_size=5))
+@settings(suppress_health_check=[HealthCheck.too_slow])
+def test_email_paths(grant):
+    # test oracle: what LooksLikeEmail did before, going through the flattened grant
+    expected = [
+        key for key, value in OrderedDict(flatten_dict(grant)).items()
+        if "email" not in key and isinstance(value, str) and compiled_email_re.search(value)
+    ]
+    assert email_paths(grant) == expected
+
+
+field_grant_json = st.recursive(
+    st.integers() | st.text(max_size=3) | st.none(),
+    lambda children: st.lists(children, max_size=3) | st.dictionaries(st.sampled_from(["a", "b", "0"]), children),
+    max_leaves=10,
+)
+
+
+@given(field_grant_json, st.lists(st.sampled_from(["a", "b", "0", "1"]), min_size=1, max_size=4))
+def test_compile_field_path(grant, parts):
+    # test oracle: indexing into the grant as the FieldNotPresentBase checks did before,
+    # except that values of the wrong type (which raised TypeError, or indexed into a
+    # string) are now treated as missing
+    expected = grant
+    try:
+        for part in parts:
+            if isinstance(expected, str):
+                raise TypeError
+            expected = expected[int(part) if part.isdigit() else part]
+    except (KeyError, IndexError, TypeError):
+        expected = None
+    assert compile_field_path("/".join(parts))(grant) == expected
+
+
+@given(st.lists(st.text(max_size=2) | st.integers(min_value=-3, max_value=3)))
+def test_repeated_values(values):
+    # test oracle: how GrantsAggregator found the duplicate ids before, with sets
+    seen = set()
+    repeated = set()
+    for value in values:
+        if value in seen:
+            repeated.add(value)
+        seen.add(value)
+    assert repeated_values(values) == repeated
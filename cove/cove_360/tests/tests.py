@@ -1,5 +1,10 @@
+import copy
+import io
+import json
 import os
+import pickle
 from datetime import datetime
+from decimal import Decimal
 from django.urls import reverse_lazy
 
 import pytest
@@ -8,8 +13,20 @@ from cove.input.models import SuppliedData
 from django.core.files.base import ContentFile
 from django.core.files.uploadedfile import UploadedFile
 
-from lib360dataquality.cove.threesixtygiving import get_grants_aggregates, run_extra_checks, extend_numbers, spreadsheet_style_errors_table, TEST_CLASSES
-from lib360dataquality.additional_test import TestCategories, TestImportance
+from lib360dataquality.cove.threesixtygiving import (
+    common_checks_360, get_grants_aggregates, get_grants_aggregates_from_file, GrantsAggregator, repeated_values, run_extra_checks, run_checks, stream_checks_360, plan_checks, CheckTimings,
+    convert_string_date_to_datetime, DateError, extend_numbers, spreadsheet_style_errors_table, TEST_CLASSES,
+    CheckFailures, RecipientIndWithoutToIndividualsDetails, SpreadsheetLocations, produce_check_results,
+)
+from lib360dataquality.additional_test import (
+    GrantBitset, JsonLocations, ReferenceTime, TestCategories, TestImportance, VerdictCache
+)
+from lib360dataquality.check_field_present import (
+    BeneficiaryLocationGeoCodeNotPresent, IndividualsCodeListsNotPresent, PlannedDurationNotPresent,
+    field_not_present_tests, field_not_present_tests_from_schema, schema_field_paths,
+)
+from lib360dataquality.coverage import get_unique_fields_present
+from lib360dataquality.sketches import HyperLogLog, IdHashes, QuantileSketch
 
 # Source is cove_360/fixtures/fundingproviders-grants_fixed_2_grants.json
 # see cove_360/fixtures/SOURCES for more info.
@@ -978,6 +995,824 @@ def test_usefulness_checks():
     assert test_result == USEFULNESS_CHECKS_RESULTS
 
 
+def test_get_grants_aggregates_from_file(tmp_path):
+    path = tmp_path / 'grants.json'
+    path.write_text(json.dumps(GRANTS, default=str))
+    with open(path) as fp:
+        data = json.load(fp, parse_float=Decimal)
+
+    assert get_grants_aggregates_from_file(str(path)) == get_grants_aggregates(data)
+    with open(path) as fp:
+        assert get_grants_aggregates_from_file(str(path), use_float=True) == get_grants_aggregates(json.load(fp))
+
+    aggregator = GrantsAggregator()
+    aggregates = get_grants_aggregates_from_file(str(path), aggregator=aggregator)
+    assert aggregator.count == aggregates['count'] == len(GRANTS['grants'])
+
+    path.write_text(json.dumps({'grants': ['not a grant']}))
+    assert get_grants_aggregates_from_file(str(path), ignore_errors=True) == {}
+
+
+def test_grants_aggregator_merge():
+    grants = copy.deepcopy(GRANTS['grants']) * 2
+    grants[3] = dict(grants[3], id='other', currency='USD', amountAwarded=-5, awardDate='1999-01-01')
+    grants[4] = dict(grants[4], amountAwarded=0, awardDate='')
+    grants.append(dict(grants[0], id='last', currency='USD', amountAwarded=7, awardDate='2030-12-31T10:00:00'))
+    expected = get_grants_aggregates({'grants': grants})
+    assert expected['duplicate_ids']
+
+    def aggregator(part):
+        part_aggregator = GrantsAggregator()
+        for grant in part:
+            part_aggregator.process(grant)
+        return part_aggregator
+
+    for first in range(len(grants) + 1):
+        for second in range(first, len(grants) + 1):
+            parts = [grants[:first], grants[first:second], grants[second:]]
+            merged = aggregator(parts[0])
+            merged.merge(aggregator(parts[1]))
+            merged.merge(aggregator(parts[2]))
+            assert merged.produce_aggregates() == expected
+            # Merging is associative
+            later = aggregator(parts[1])
+            later.merge(aggregator(parts[2]))
+            merged = aggregator(parts[0])
+            merged.merge(later)
+            assert merged.produce_aggregates() == expected
+
+
+@pytest.mark.parametrize('use_numpy', [True, False])
+def test_repeated_values(monkeypatch, use_numpy):
+    from lib360dataquality.cove import threesixtygiving
+    if not use_numpy:
+        monkeypatch.setattr(threesixtygiving, 'numpy', None)
+
+    # hash(-1) == hash(-2), so they are only told apart by comparing them
+    values = ['a', -1, 'b', -2, 'a', -1, 'c', 1, 1.0, 'a']
+    assert repeated_values(values) == {'a', -1, 1}
+    assert repeated_values(['a', -1, -2]) == set()
+    assert repeated_values([]) == set()
+
+
+def test_grant_ids():
+    # The aggregates have the same ids as a set of them would be
+    grants = copy.deepcopy(GRANTS['grants']) * 3
+    aggregates = get_grants_aggregates({'grants': grants})
+    assert isinstance(aggregates['unique_ids'], set)
+    assert aggregates['unique_ids'] == {grant['id'] for grant in grants}
+    assert aggregates['duplicate_ids'] == {grant['id'] for grant in GRANTS['grants']}
+
+
+def test_hyperloglog():
+    sketch = HyperLogLog()
+    values = ['GB-CHC-{}'.format(number) for number in range(200000)]
+    for value in values[:100]:
+        sketch.add(value)
+        sketch.add(value)
+    # Small counts are close to exact
+    assert abs(len(sketch) - 100) <= 1
+
+    first, second = HyperLogLog(), HyperLogLog()
+    for value in values[:120000]:
+        first.add(value)
+    for value in values[80000:]:
+        second.add(value)
+    first.merge(second)
+    assert abs(len(first) - 200000) < 3 * first.relative_error * 200000
+    whole = HyperLogLog()
+    for value in values:
+        whole.add(value)
+    assert first.registers == whole.registers
+
+    with pytest.raises(ValueError):
+        first.merge(HyperLogLog(precision=10))
+
+
+def test_quantile_sketch():
+    random = __import__('random').Random(0)
+    amounts = [round(random.lognormvariate(8, 2), 2) for _ in range(20000)] + [-50, -5, 0, 0]
+    first, second = QuantileSketch(), QuantileSketch()
+    for amount in amounts[:7000]:
+        first.add(amount)
+    for amount in amounts[7000:]:
+        second.add(Decimal(str(amount)))
+    first.merge(second)
+    whole = QuantileSketch()
+    for amount in amounts:
+        whole.add(amount)
+    assert (first.positive, first.negative, first.zero_count) == (whole.positive, whole.negative, whole.zero_count)
+
+    amounts.sort()
+    for quantile in [0, 0.001, 0.1, 0.5, 0.9, 0.99, 1]:
+        exact = amounts[int(quantile * (len(amounts) - 1))]
+        assert abs(first.quantile(quantile) - exact) <= 0.01 * abs(exact)
+    # Numbers that aren't finite are ignored
+    first.add(float('nan'))
+    first.add(10 ** 400)
+    assert first.count == len(amounts)
+    assert QuantileSketch().quantile(0.5) is None
+    with pytest.raises(ValueError):
+        first.merge(QuantileSketch(relative_accuracy=0.02))
+
+    grants = [{'currency': 'GBP', 'amountAwarded': amount} for amount in range(1, 1001)]
+    currencies = get_grants_aggregates({'grants': grants + [{'currency': 'USD'}]})['currencies']
+    assert abs(currencies['GBP']['p50_amount'] - 500) <= 5
+    assert abs(currencies['GBP']['p90_amount'] - 900) <= 9
+    assert abs(currencies['GBP']['p99_amount'] - 990) <= 10
+    assert currencies['USD']['p50_amount'] is None
+
+
+def test_id_hashes():
+    id_hashes = IdHashes()
+    for grant_id in ['a', 'b', 'a', 'c', 'a', 1, '1', 1]:
+        id_hashes.add(grant_id)
+    assert len(id_hashes.repeated()) == 2
+    assert id_hashes.hashes.itemsize == 8
+
+
+def test_grants_aggregator_approximate_distinct():
+    grants = copy.deepcopy(GRANTS['grants']) * 3
+    grants[0] = dict(grants[0], id='unique')
+    expected = get_grants_aggregates({'grants': grants})
+
+    approximate = GrantsAggregator(approximate_distinct=True)
+    for grant in grants[:4]:
+        approximate.process(grant)
+    # Exact aggregators can be merged into approximate ones
+    exact = GrantsAggregator()
+    for grant in grants[4:]:
+        exact.process(grant)
+    approximate.merge(exact)
+    aggregates = approximate.produce_aggregates()
+
+    assert aggregates['unique_ids_count'] == len(expected['unique_ids'])
+    assert aggregates['duplicate_ids_count'] == len(expected['duplicate_ids'])
+    for key in ['distinct_funding_org_identifier', 'distinct_recipient_org_identifier']:
+        assert aggregates[key + '_count'] == len(expected[key])
+        assert key not in aggregates
+    for key in ['count', 'id_count', 'award_years', 'currencies', 'min_award_date', 'max_award_date']:
+        assert aggregates[key] == expected[key]
+    assert 0 < aggregates['distinct_count_error'] < 0.01
+
+    with pytest.raises(ValueError):
+        exact.merge(approximate)
+
+
+def test_run_checks_single_pass():
+    aggregates, test_results = run_checks(GRANTS, SOURCE_MAP, TEST_CLASSES)
+
+    assert aggregates == get_grants_aggregates(GRANTS, ignore_errors=True)
+    assert test_results['quality_accuracy'] == QUALITY_ACCURACY_CHECKS_RESULTS
+    assert test_results['usefulness'] == USEFULNESS_CHECKS_RESULTS
+
+
+def test_run_checks_errors_per_group():
+    class BrokenTest(TEST_CLASSES['usefulness'][0]):
+        def process(self, grant, path_prefix):
+            raise KeyError('broken')
+
+    aggregates, test_results = run_checks(
+        GRANTS, SOURCE_MAP, {'quality_accuracy': TEST_CLASSES['quality_accuracy'], 'usefulness': [BrokenTest]},
+        ignore_errors=True
+    )
+
+    assert aggregates['count'] == len(GRANTS['grants'])
+    assert test_results['quality_accuracy'] == QUALITY_ACCURACY_CHECKS_RESULTS
+    assert test_results['usefulness'] is None
+
+
+def test_run_extra_checks_without_features_argument():
+    seen = []
+
+    class OldStyleTest(TEST_CLASSES['usefulness'][0]):
+        def process(self, grant, path_prefix):
+            seen.append(path_prefix)
+
+    # Worked out once for the class rather than for each batch
+    assert not OldStyleTest.process_takes_features
+    assert TEST_CLASSES['usefulness'][0].process_takes_features
+    aggregates = get_grants_aggregates(GRANTS, ignore_errors=True)
+    assert run_extra_checks(GRANTS, SOURCE_MAP, [OldStyleTest], aggregates) == []
+    assert seen == ['grants/0', 'grants/1', 'grants/2']
+
+
+def test_run_extra_checks_process_batch(monkeypatch):
+    from lib360dataquality.cove import threesixtygiving
+
+    test_class = next(
+        test_class for test_class in TEST_CLASSES['usefulness'] if test_class.__name__ == 'TitleLength'
+    )
+    batches = []
+
+    class BatchTest(test_class):
+        def process_batch(self, grants, start_index=0, features=None):
+            batches.append((start_index, [grant['id'] for grant in grants], [f.index for f in features]))
+            for num, grant in enumerate(grants, start_index):
+                if len(grant.get('title', '')) > 140:
+                    self.failed = True
+                    self.count += 1
+                    self.add_location('grants/{}'.format(num), '/title')
+
+    monkeypatch.setattr(threesixtygiving, 'PROCESS_BATCH_SIZE', 2)
+    data = {'grants': GRANTS['grants'] * 2}
+    aggregates = get_grants_aggregates(data, ignore_errors=True)
+    results = run_extra_checks(data, {}, [BatchTest], aggregates)
+    grant_ids = [grant['id'] for grant in data['grants']]
+    assert batches == [(0, grant_ids[0:2], [0, 1]), (2, grant_ids[2:4], [2, 3]), (4, grant_ids[4:6], [4, 5])]
+    # The same as a grant at a time
+    assert results == run_checks(data, {}, {'usefulness': [BatchTest]})[1]['usefulness']
+    assert [json_locations for _, json_locations, _ in results] == [
+        json_locations for _, json_locations, _ in run_extra_checks(data, {}, [test_class], aggregates)
+    ]
+    assert results[0][1] == ['grants/1/title', 'grants/4/title']
+
+
+def minimal_schema(tmp_path):
+    """A Schema360 that doesn't need to be downloaded, for running common_checks_360"""
+    from lib360dataquality.cove.schema import Schema360
+
+    (tmp_path / 'package-schema.json').write_text(json.dumps(
+        {'type': 'object', 'properties': {'grants': {'type': 'array', 'items': {}}}}
+    ))
+    (tmp_path / 'grant-schema.json').write_text(json.dumps({'type': 'object', 'properties': {'id': {'type': 'string'}}}))
+    return Schema360(str(tmp_path), str(tmp_path / 'package-schema.json'), str(tmp_path / 'grant-schema.json'))
+
+
+def test_common_checks_360_process_batch(monkeypatch, tmp_path):
+    from lib360dataquality.cove import threesixtygiving
+
+    test_class = next(
+        test_class for test_class in TEST_CLASSES['usefulness'] if test_class.__name__ == 'TitleLength'
+    )
+    batches = []
+
+    class BatchTest(test_class):
+        def process_batch(self, grants, start_index=0, features=None):
+            batches.append(start_index)
+            super().process_batch(grants, start_index, features)
+
+    monkeypatch.setattr(threesixtygiving, 'PROCESS_BATCH_SIZE', 2)
+    monkeypatch.setitem(threesixtygiving.TEST_CLASSES, 'usefulness', [BatchTest])
+    data = {'grants': GRANTS['grants'] * 2}
+    context = common_checks_360({'file_type': 'json'}, str(tmp_path), data, minimal_schema(tmp_path))
+
+    assert batches == [0, 2, 4]
+    assert [json_locations for _, json_locations, _ in context['usefulness_checks']] == [
+        ['grants/1/title', 'grants/4/title']
+    ]
+
+
+def test_common_checks_360_plan_checks(monkeypatch, tmp_path):
+    from lib360dataquality.cove import threesixtygiving
+
+    batches = []
+
+    class RecordedTest(RecipientIndWithoutToIndividualsDetails):
+        def process_batch(self, grants, start_index=0, features=None):
+            batches.append(start_index)
+            super().process_batch(grants, start_index, features)
+
+    monkeypatch.setattr(threesixtygiving, 'PROCESS_BATCH_SIZE', 2)
+    monkeypatch.setitem(threesixtygiving.TEST_CLASSES, 'usefulness', [RecordedTest])
+    grants = [{'id': str(num), 'recipientOrganization': [{'id': 'GB-COH-{}'.format(num)}]} for num in range(6)]
+    context = common_checks_360({'file_type': 'json'}, str(tmp_path), {'grants': grants}, minimal_schema(tmp_path))
+
+    # No grant is to an individual, so the check is skipped
+    assert batches == []
+    assert context['usefulness_checks'] == []
+
+    grants[3] = {'id': '3', 'recipientIndividual': {'id': 'ind-3'}}
+    context = common_checks_360({'file_type': 'json'}, str(tmp_path), {'grants': grants}, minimal_schema(tmp_path))
+
+    # The check is only run from the batch with the grant to an individual
+    assert batches == [2, 4]
+    assert [json_locations for _, json_locations, _ in context['usefulness_checks']] == [
+        ['grants/3/recipientIndividual/id']
+    ]
+
+
+def test_field_not_present_tests():
+    schema = {
+        'properties': {
+            'id': {'type': 'string'},
+            'beneficiaryLocation': {'type': 'array', 'items': {'$ref': '#/definitions/Location'}},
+            'recipientOrganization': {'type': ['array', 'null'], 'items': {'$ref': '#/definitions/Organization'}},
+            'tags': {'type': 'array', 'items': {'type': 'string'}},
+        },
+        'definitions': {
+            'Location': {'type': 'object', 'properties': {'name': {'type': 'string'}, 'geoCode': {'type': 'string'}}},
+            'Organization': {
+                'type': 'object',
+                'properties': {
+                    'id': {'type': 'string'},
+                    'parent': {'$ref': '#/definitions/Organization'},
+                    'location': {'$ref': '#/definitions/Location'},
+                },
+            },
+        },
+    }
+    assert schema_field_paths(schema) == [
+        'id',
+        'beneficiaryLocation/0/name',
+        'beneficiaryLocation/0/geoCode',
+        'recipientOrganization/0/id',
+        'recipientOrganization/0/location/name',
+        'recipientOrganization/0/location/geoCode',
+        'tags',
+    ]
+
+    test_classes = field_not_present_tests_from_schema(schema)
+    assert test_classes[2].__name__ == 'BeneficiaryLocationGeoCodeNotPresent'
+    assert [test_class.__name__ for test_class in field_not_present_tests(['tags'])] == ['TagsNotPresent']
+
+    grants = [
+        {'id': '1', 'beneficiaryLocation': [{'name': 'Place', 'geoCode': 'E1'}], 'tags': ['a']},
+        {'id': '2', 'beneficiaryLocation': [{'name': 'Place'}], 'recipientOrganization': None, 'tags': []},
+        {'id': '3', 'beneficiaryLocation': 'Place', 'recipientOrganization': [{'location': {'name': 'Place'}}]},
+    ]
+    results = run_extra_checks({'grants': grants}, {}, test_classes, {'count': 3})
+    assert {message['type']: list(json_locations) for message, json_locations, _ in results} == {
+        'BeneficiaryLocationNameNotPresent': ['grants/2/id'],
+        'BeneficiaryLocationGeoCodeNotPresent': ['grants/1/id', 'grants/2/id'],
+        'RecipientOrganizationIdNotPresent': ['grants/0/id', 'grants/1/id', 'grants/2/id'],
+        'RecipientOrganizationLocationNameNotPresent': ['grants/0/id', 'grants/1/id'],
+        'RecipientOrganizationLocationGeoCodeNotPresent': ['grants/0/id', 'grants/1/id', 'grants/2/id'],
+        'TagsNotPresent': ['grants/1/id', 'grants/2/id'],
+    }
+    # The same as the hand-written check
+    assert run_extra_checks({'grants': grants}, {}, [BeneficiaryLocationGeoCodeNotPresent], {'count': 3}) == [
+        results[1]
+    ]
+
+    # Only field paths are compiled, not the descriptions of tests that override check_field()
+    assert 'get_field' in vars(BeneficiaryLocationGeoCodeNotPresent)
+    assert 'get_field' not in vars(PlannedDurationNotPresent)
+    assert 'get_field' not in vars(IndividualsCodeListsNotPresent)
+
+
+def parallel_grants():
+    # Funder names and ids that change between grants, so the first value seen for them
+    # differs between the ranges of grants checked by each process
+    grants = []
+    for num in range(12):
+        for grant in GRANTS['grants']:
+            grant = copy.deepcopy(grant)
+            grant['id'] = '{}-{}'.format(grant['id'], num)
+            funder = grant['fundingOrganization'][0]
+            funder['name'] = 'Funder {}'.format(num % 3)
+            funder['id'] = 'XE-EXAMPLE-{}'.format(num // 4)
+            grants.append(grant)
+    return grants
+
+
+def test_run_extra_checks_parallel():
+    data = {'grants': parallel_grants()}
+    test_classes = TEST_CLASSES['quality_accuracy'] + TEST_CLASSES['usefulness']
+    aggregates = get_grants_aggregates(data, ignore_errors=True)
+
+    serial = run_extra_checks(data, SOURCE_MAP, test_classes, aggregates)
+    assert serial
+    for workers in (2, 5):
+        assert run_extra_checks(data, SOURCE_MAP, test_classes, aggregates, workers=workers) == serial
+
+
+def test_common_checks_360_parallel(tmp_path):
+    grants = parallel_grants()
+    # A repeated id, and a check that is only run from part way through the last range of grants
+    grants[30]['id'] = grants[2]['id']
+    grants[33]['recipientIndividual'] = {'id': 'ind-33'}
+    schema = minimal_schema(tmp_path)
+
+    serial = common_checks_360({'file_type': 'json'}, str(tmp_path), {'grants': grants}, schema)
+    assert serial['grants_aggregates']['duplicate_ids'] == {grants[2]['id']}
+    for workers in (2, 5):
+        context = common_checks_360({'file_type': 'json'}, str(tmp_path), {'grants': grants}, schema, workers=workers)
+        for key in ('grants_aggregates', 'quality_accuracy_checks', 'usefulness_checks'):
+            assert context[key] == serial[key]
+
+    # With too few grants to split up
+    assert run_checks({'grants': grants[:1]}, {}, TEST_CLASSES, workers=2) == run_checks({'grants': grants[:1]}, {}, TEST_CLASSES)
+
+
+def test_stream_checks_360():
+    fp = io.BytesIO(json.dumps(GRANTS).encode())
+    context = stream_checks_360(fp)
+
+    assert context['grants_aggregates'] == get_grants_aggregates(GRANTS, ignore_errors=True)
+    # There are no spreadsheet locations for JSON
+    assert context['quality_accuracy_checks'] == [result[:2] + ([],) for result in QUALITY_ACCURACY_CHECKS_RESULTS]
+    assert context['usefulness_checks'] == [result[:2] + ([],) for result in USEFULNESS_CHECKS_RESULTS]
+    assert context['usefulness_errored'] is False
+    assert context['fields_present'] == get_unique_fields_present(GRANTS)
+
+
+@pytest.mark.parametrize('data', [
+    # Broken after the first grant, so some of the grants have been checked
+    json.dumps(GRANTS)[:-200],
+    '{"grants": [{"id": "a"}, }',
+    '{"grants": [{"id": "a"}]} junk',
+])
+def test_stream_checks_360_not_json(data):
+    with pytest.raises(ValueError, match='not well formed JSON'):
+        stream_checks_360(io.BytesIO(data.encode()))
+
+
+def test_grant_columns_match_per_grant_checks(monkeypatch):
+    from lib360dataquality.cove import threesixtygiving
+
+    amounts = [0, 0.0, Decimal('0'), Decimal('1E-400'), False, '0', 10, None]
+    dates = [
+        '2021-02-30', '2021-13-01', '2021-01-32', '0000-01-01', '2100-01-01', '1900-01-01',
+        '2021-01-01T10:00:00', '2020-01-01', '2022-01-01', '', 'junk',
+    ]
+    grants = []
+    for num in range(len(amounts) * len(dates)):
+        grant = {'id': 'grant-{}'.format(num), 'awardDate': dates[num % len(dates)]}
+        if num % len(amounts) != len(amounts) - 1:
+            grant['amountAwarded'] = amounts[num % len(amounts)]
+        if num % 3:
+            grant['plannedDates'] = [{
+                'startDate': dates[(num + 1) % len(dates)],
+                'endDate': dates[(num + 2) % len(dates)],
+            }]
+        if num % 4:
+            grant['actualDates'] = [{
+                'startDate': dates[(num + 3) % len(dates)],
+                'endDate': dates[(num + 5) % len(dates)],
+            }]
+        if num % 13 == 0:
+            grant['actualDates'] = []
+        grants.append(grant)
+    data = {'grants': grants}
+    test_classes = [
+        test_class for test_class in TEST_CLASSES['quality_accuracy'] + TEST_CLASSES['usefulness']
+        if hasattr(test_class, 'process_columns')
+    ]
+    assert len(test_classes) == 8
+    aggregates = get_grants_aggregates(data, ignore_errors=True)
+
+    monkeypatch.setattr(threesixtygiving.GrantColumns, 'chunk_size', 7)
+    columns_results = run_extra_checks(data, {}, test_classes, aggregates)
+    assert len(columns_results) == 8
+
+    monkeypatch.setattr(threesixtygiving, 'numpy', None)
+    assert run_extra_checks(data, {}, test_classes, aggregates) == columns_results
+
+
+def test_grant_dates_parsed_once_per_run(monkeypatch):
+    from lib360dataquality.cove import threesixtygiving
+
+    calls = []
+
+    def create_grant_dates_dict(grant):
+        calls.append(grant['id'])
+        return original(grant)
+
+    original = threesixtygiving.create_grant_dates_dict
+    monkeypatch.setattr(threesixtygiving, 'create_grant_dates_dict', create_grant_dates_dict)
+
+    grant_ids = [grant['id'] for grant in GRANTS['grants']]
+    run_checks(GRANTS, SOURCE_MAP, TEST_CLASSES)
+    # Shared by all of the date checks
+    assert calls == grant_ids
+    # Nothing is kept between runs
+    run_checks(GRANTS, SOURCE_MAP, TEST_CLASSES)
+    assert calls == grant_ids * 2
+
+
+@pytest.mark.parametrize(('input_date', 'expected'), [
+    ('2021-01-31', (datetime(2021, 1, 31), None)),
+    ('2021-01-31T10:00:00+00:00', (datetime(2021, 1, 31), None)),
+    ('2021-1-5', (datetime(2021, 1, 5), None)),
+    ('2021-02-30', (None, DateError.OUT_OF_RANGE)),
+    ('0000-01-01', (None, DateError.OUT_OF_RANGE)),
+    ('2021-13-01', (None, DateError.BAD_FORMAT)),
+    ('31/01/2021', (None, DateError.BAD_FORMAT)),
+    ('', (None, DateError.BAD_FORMAT)),
+    ('2021-01-32', (None, DateError.TRAILING_DATA)),
+    ('2021-01-31 10:00', (None, DateError.TRAILING_DATA)),
+])
+def test_convert_string_date_to_datetime(input_date, expected):
+    assert convert_string_date_to_datetime(input_date) == expected
+
+
+@pytest.mark.parametrize('use_numpy', [True, False])
+def test_run_extra_checks_reference_time(monkeypatch, use_numpy):
+    from lib360dataquality.cove import threesixtygiving
+
+    if not use_numpy:
+        monkeypatch.setattr(threesixtygiving, 'numpy', None)
+    test_classes = [
+        threesixtygiving.FarFuturePlannedDates,
+        threesixtygiving.FarFutureActualDates,
+        threesixtygiving.FarPastDates,
+        threesixtygiving.PostDatedAwardDates,
+    ]
+    aggregates = get_grants_aggregates(GRANTS, ignore_errors=True)
+
+    def failed_checks(test_options):
+        results = run_extra_checks(GRANTS, SOURCE_MAP, test_classes, aggregates, test_options=test_options)
+        return {message['type'] for message, _, _ in results}
+
+    assert failed_checks(None) == {
+        'FarFuturePlannedDates', 'FarFutureActualDates', 'FarPastDates', 'PostDatedAwardDates'
+    }
+    # As of two years from now none of the award dates are in the future, and the
+    # planned and actual dates aren't as far in the future
+    as_of = ReferenceTime(datetime(current_year + 2, 1, 1))
+    assert failed_checks({'reference_time': as_of}) == {'FarPastDates'}
+    # A time with a timezone, as tools/cove_checks.py --as-of can give, is compared as UTC
+    as_of = ReferenceTime(datetime.fromisoformat('{}-01-01T01:00:00+02:00'.format(current_year + 2)))
+    assert as_of.now == datetime(current_year + 1, 12, 31, 23)
+    assert failed_checks({'reference_time': as_of}) == {'FarPastDates'}
+
+
+def test_prefix_trie():
+    from lib360dataquality.cove.threesixtygiving import PrefixTrie, orgids_prefixes
+
+    trie = PrefixTrie(['GB-SC', 'GB-SCOT', 'GB', 'XI-'])
+    assert trie.match('GB-SCOT-1') == 'GB-SC'
+    assert trie.match('GB-COH-1') == 'GB'
+    assert trie.match('gb-sc-1') is None
+    assert trie.match('XI') is None
+    assert trie.match('') is None
+    assert PrefixTrie(['GB-SCOT', 'GB-SC']).match('GB-SCOT-1') == 'GB-SCOT'
+    assert PrefixTrie(['GB-SC'], ignore_case=True).match('gb-sc-1') == 'GB-SC'
+
+    # The same as trying each of the prefixes in turn
+    org_ids = ['GB-CHC-123', 'gb-chc-123', 'GB-COH-0001', '360G-abc', '360g-abc', 'XE-EXAMPLE', 'GB', 'ABC-', '']
+    trie = PrefixTrie(orgids_prefixes)
+    trie_ignore_case = PrefixTrie(orgids_prefixes, ignore_case=True)
+    for org_id in org_ids:
+        assert trie.match(org_id) == next(
+            (prefix for prefix in orgids_prefixes if org_id.startswith(prefix)), None
+        )
+        assert trie_ignore_case.match(org_id) == next(
+            (prefix for prefix in orgids_prefixes if org_id.lower().startswith(prefix.lower())), None
+        )
+
+
+def test_verdict_cache():
+    from lib360dataquality.cove.threesixtygiving import org_id_looks_invalid
+
+    calls = []
+
+    def classify(value):
+        calls.append(value)
+        return value.startswith('GB-')
+
+    verdict_cache = VerdictCache()
+    assert [verdict_cache.verdict(classify, value) for value in ['GB-1', 'XI-1', 'GB-1']] == [True, False, True]
+    assert calls == ['GB-1', 'XI-1']
+    # Values that can't be cached are still classified
+    assert verdict_cache.verdict(len, ['GB-1']) == 1
+    # Equal values of different types are classified separately
+    assert [verdict_cache.verdict(repr, value) for value in [1, 1.0, True, Decimal('1'), 1]] == [
+        '1', '1.0', 'True', "Decimal('1')", '1'
+    ]
+
+    data = {'grants': GRANTS['grants'] * 3}
+    test_classes = TEST_CLASSES['quality_accuracy'] + TEST_CLASSES['usefulness']
+    aggregates = get_grants_aggregates(data, ignore_errors=True)
+    verdict_cache = VerdictCache()
+    results = run_extra_checks(data, {}, test_classes, aggregates, test_options={'verdict_cache': verdict_cache})
+    assert results == run_extra_checks(data, {}, test_classes, aggregates)
+    # Each distinct identifier was only classified once
+    org_ids = {
+        org['id'] for grant in GRANTS['grants']
+        for org in grant.get('fundingOrganization', []) + grant.get('recipientOrganization', [])
+    }
+    assert {org_id for _, org_id in verdict_cache.verdicts[org_id_looks_invalid]} == org_ids
+    assert len(verdict_cache.verdicts[org_id_looks_invalid]) == len(org_ids)
+
+
+def test_plan_checks():
+    data = copy.deepcopy(GRANTS)
+    for grant in data['grants']:
+        grant.pop('beneficiaryLocation', None)
+    test_classes = TEST_CLASSES['quality_accuracy'] + TEST_CLASSES['usefulness']
+    aggregates = get_grants_aggregates(data, ignore_errors=True)
+    fields_present = get_unique_fields_present(data)
+
+    skipped = {
+        test_class.__name__ for test_class in test_classes
+        if test_class not in plan_checks(test_classes, fields_present)
+    }
+    assert skipped == {
+        'RecipientIndDEI',
+        'GeoCodePostcode',
+        'RecipientIndWithoutToIndividualsDetails',
+        'BeneficiaryButNotRecipientGeoData',
+        'BeneficiaryLocationNameButNoCode',
+    }
+    # Skipped tests can't fail, so the results are the same
+    assert run_extra_checks(data, SOURCE_MAP, test_classes, aggregates, fields_present=fields_present) == \
+        run_extra_checks(data, SOURCE_MAP, test_classes, aggregates)
+
+    # An empty recipientIndividual isn't counted in the aggregates, but the tests
+    # of grants to individuals can still fail on it
+    data = copy.deepcopy(GRANTS)
+    data['grants'][0]['recipientIndividual'] = {}
+    aggregates = get_grants_aggregates(data, ignore_errors=True)
+    assert aggregates['recipient_individuals_count'] == 0
+    fields_present = get_unique_fields_present(data)
+    assert RecipientIndWithoutToIndividualsDetails in plan_checks(test_classes, fields_present)
+    results = run_extra_checks(data, SOURCE_MAP, test_classes, aggregates, fields_present=fields_present)
+    assert results == run_extra_checks(data, SOURCE_MAP, test_classes, aggregates)
+    assert 'RecipientIndWithoutToIndividualsDetails' in [message['type'] for message, _, _ in results]
+
+
+def test_run_checks_timings():
+    timings = CheckTimings()
+    run_checks(GRANTS, SOURCE_MAP, TEST_CLASSES, timings=timings)
+    timings = timings.as_dict()
+
+    assert timings['stages']['get_grants_aggregates']['calls'] == 4
+    test_classes = TEST_CLASSES['quality_accuracy'] + TEST_CLASSES['usefulness']
+    assert set(timings['checks']) == {test_class.__name__ for test_class in test_classes}
+    # Given all of the grants in one batch
+    assert timings['checks']['TitleLength']['calls'] == 1
+    assert timings['checks']['TitleLength']['time'] > 0
+    assert timings['checks']['ZeroAmountTest']['failures'] == 1
+    assert timings['checks']['GrantIdUnexpectedChars']['failures'] == 0
+
+
+def test_json_locations_limit():
+    locations = JsonLocations(limit=3)
+    locations.extend('grants/{}/id'.format(num) for num in range(10))
+    assert locations == ['grants/0/id', 'grants/1/id', 'grants/2/id']
+    assert locations.total == 10
+
+    other = JsonLocations(limit=3)
+    other.extend('grants/{}/id'.format(num) for num in range(10, 12))
+    locations.merge(other)
+    assert locations == ['grants/0/id', 'grants/1/id', 'grants/2/id']
+    assert locations.total == 12
+
+    unpickled = pickle.loads(pickle.dumps(locations))
+    assert unpickled == locations
+    assert unpickled.total == 12
+
+
+def test_json_locations_sample():
+    locations = JsonLocations(limit=10, sample=True)
+    locations.extend(range(1000))
+    assert len(locations) == 10
+    assert locations.total == 1000
+    assert locations == sorted(locations)
+    # Spread across all of them rather than the first ones
+    assert max(locations) > 500
+
+    other = JsonLocations(limit=10, sample=True)
+    other.extend(range(1000, 3000))
+    locations.merge(other)
+    assert len(locations) == 10
+    assert locations.total == 3000
+    assert locations == sorted(locations)
+
+
+def test_modal_errors_locations_notice():
+    from django.template.loader import render_to_string
+
+    def notice(error_list, sample=False):
+        html = render_to_string('cove_360/modal_errors.html', {
+            'errorList': error_list,
+            'file_type': 'json',
+            'validation_error_locations_length': 5,
+            'validation_error_locations_sample': sample,
+        })
+        return ' '.join(html.split('<p>')[1].split('</p>')[0].split())
+
+    locations = JsonLocations(limit=5)
+    locations.extend('grants/{}/id'.format(num) for num in range(20))
+    assert notice(locations) == 'Showing the first 5 of the 20 locations for this error.'
+    assert notice(locations, sample=True) == 'Showing a random 5 of the 20 locations for this error.'
+    # Nothing was left out
+    locations = JsonLocations(limit=5)
+    locations.extend('grants/{}/id'.format(num) for num in range(5))
+    assert notice(locations) == ''
+    assert notice(locations, sample=True) == ''
+    assert notice(['grants/0/id']) == ''
+    assert notice(['grants/{}/id'.format(num) for num in range(6)]) == 'Showing the first 5 locations for this error.'
+
+    # The spreadsheet locations of a check's kept json locations
+    locations = JsonLocations(limit=5)
+    locations.extend('grants/{}/id'.format(num) for num in range(20))
+    test_instance = RecipientIndWithoutToIndividualsDetails(grants=[], aggregates={})
+    test_instance.failed = True
+    test_instance.json_locations = locations
+    test_instance.produce_message = lambda: {}
+    cell_source_map = {location: [('grants', 'A', num + 2, 'Identifier')] for num, location in enumerate(locations)}
+    [(message, json_locations, spreadsheet_locations)] = produce_check_results([test_instance], cell_source_map)
+    assert spreadsheet_locations == [
+        {'sheet': 'grants', 'letter': 'A', 'row_number': num + 2, 'header': 'Identifier'} for num in range(5)
+    ]
+    assert spreadsheet_locations.total == 20
+    assert pickle.loads(pickle.dumps(spreadsheet_locations)).total == 20
+    assert notice(spreadsheet_locations) == 'Showing the first 5 of the 20 locations for this error.'
+    assert notice(SpreadsheetLocations(spreadsheet_locations[:2])) == ''
+
+
+def test_json_locations_compact():
+    locations = JsonLocations()
+    locations.add(12, '/recipientOrganization/0/id')
+    locations.append('grants/3/recipientOrganization/0/id')
+    locations.append('grants/x/id')
+    locations.append('/recipientOrganization/0/id')
+    assert locations == [
+        'grants/12/recipientOrganization/0/id',
+        'grants/3/recipientOrganization/0/id',
+        'grants/x/id',
+        '/recipientOrganization/0/id',
+    ]
+    assert locations[1] == 'grants/3/recipientOrganization/0/id'
+    assert locations[-1] == '/recipientOrganization/0/id'
+    assert locations[:1] == ['grants/12/recipientOrganization/0/id']
+    # The suffix is only stored once
+    assert locations.suffixes == ['/recipientOrganization/0/id', 'grants/x/id']
+
+    unpickled = pickle.loads(pickle.dumps(locations))
+    assert unpickled == locations
+    unpickled.append('grants/4/recipientOrganization/0/id')
+    assert len(unpickled.suffixes) == 2
+
+
+def test_grant_bitset():
+    bitset = GrantBitset([3, 0, 17])
+    assert list(bitset) == [0, 3, 17]
+    assert len(bitset) == 3
+    assert 17 in bitset and 4 not in bitset and 1000 not in bitset
+    bitset.update(GrantBitset([4, 2000]))
+    assert list(bitset) == [0, 3, 4, 17, 2000]
+    assert bitset.as_int() == (1 << 0) | (1 << 3) | (1 << 4) | (1 << 17) | (1 << 2000)
+
+    # Grants are recorded even when their locations aren't kept
+    locations = JsonLocations(limit=1)
+    locations.add(5, '/id')
+    locations.append('grants/9/id')
+    locations.append('/id')
+    assert locations == ['grants/5/id']
+    assert list(locations.failing_grants) == [5, 9]
+
+
+def test_check_failures():
+    data = {'grants': GRANTS['grants'] * 4}
+    test_classes = TEST_CLASSES['quality_accuracy'] + TEST_CLASSES['usefulness']
+    aggregates = get_grants_aggregates(data, ignore_errors=True)
+    results = run_extra_checks(data, {}, test_classes, aggregates)
+
+    # The same as working it out from the json locations
+    failed = {}
+    for message, json_locations, _ in results:
+        for grant_index in set(int(location.split('/')[1]) for location in json_locations):
+            failed.setdefault(grant_index, []).append(message)
+    failures = CheckFailures(results)
+    for number in range(len(results) + 2):
+        assert failures.grants_failing_at_least(number) == sorted(
+            grant_index for grant_index, messages in failed.items() if len(messages) >= max(number, 1)
+        )
+    critical = failures.grants_failing_at_least(1, importance=TestImportance.CRITICAL)
+    assert critical == sorted(
+        grant_index for grant_index, messages in failed.items()
+        if any(message['importance'] == TestImportance.CRITICAL for message in messages)
+    )
+
+    worst = failures.worst_grants(limit=3)
+    assert worst == sorted(failed.items(), key=lambda item: (-len(item[1]), item[0]))[:3]
+
+    messages, matrix = failures.co_failure_matrix()
+    assert messages == [message for message, _, _ in results]
+    for i, first in enumerate(messages):
+        for j, second in enumerate(messages):
+            assert matrix[i][j] == sum(1 for failed_messages in failed.values()
+                                       if first in failed_messages and second in failed_messages)
+
+    # The grants are the same when the checks are run in parallel or the locations limited
+    parallel_failures = CheckFailures(run_extra_checks(
+        data, {}, test_classes, aggregates, workers=3, test_options={'max_json_locations': 1}
+    ))
+    assert parallel_failures.checks == failures.checks
+
+
+def test_run_extra_checks_max_json_locations():
+    data = {'grants': GRANTS['grants'] * 4}
+    test_classes = TEST_CLASSES['quality_accuracy'] + TEST_CLASSES['usefulness']
+    aggregates = get_grants_aggregates(data, ignore_errors=True)
+
+    results = run_extra_checks(data, {}, test_classes, aggregates)
+    limited_results = run_extra_checks(data, {}, test_classes, aggregates, test_options={'max_json_locations': 2})
+    # The counts and percentages are the same, only the examples are limited
+    assert [message for message, json_locations, _ in limited_results] == [message for message, _, _ in results]
+    for (_, json_locations, _), (_, limited_json_locations, _) in zip(results, limited_results):
+        assert limited_json_locations == json_locations[:2]
+        assert limited_json_locations.total == len(json_locations)
+
+    assert run_extra_checks(
+        data, {}, test_classes, aggregates, workers=3, test_options={'max_json_locations': 2}
+    ) == limited_results
+
+
 def test_extend_numbers():
     assert list(extend_numbers([2])) == [1, 2, 3]
     assert list(extend_numbers([4])) == [3, 4, 5]
@@ -27,7 +27,7 @@ from libcove.lib.exceptions import CoveInputDataError
 from lib360dataquality.cove.schema import Schema360, ExtensionsError
 from lib360dataquality.cove.threesixtygiving import TEST_CLASSES
 from lib360dataquality.additional_test import TestType
-from lib360dataquality.cove.threesixtygiving import common_checks_360
+from lib360dataquality.cove.threesixtygiving import common_checks_360, CheckFailures
 
 from cove_360.models import SuppliedDataStatus
 from cove_360.publishing import lookup_publisher_by_domain, extract_domain
@@ -212,7 +212,11 @@ def explore_360(request, pk, template='cove_360/explore.html'):
                     'error': format(err)
                 })
 
-    context = common_checks_360(context, upload_dir, json_data, schema_360)
+    context = common_checks_360(context, upload_dir, json_data, schema_360, test_options={
+        # Only keep as many locations for each check as can be shown
+        "max_json_locations": settings.VALIDATION_ERROR_LOCATIONS_LENGTH,
+        "sample_json_locations": settings.VALIDATION_ERROR_LOCATIONS_SAMPLE,
+    })
 
     # Construct the 360Giving specific urls for codelists in the docs
     for key in ['additional_closed_codelist_values', 'additional_open_codelist_values']:
@@ -274,6 +278,25 @@ def explore_360(request, pk, template='cove_360/explore.html'):
     if context["quality_accuracy_checks"]:
         context["quality_accuracy_checks"].sort(key=lambda x: x[0]["importance"], reverse=True)
 
+    # The grants that failed the most checks, for the advanced view
+    try:
+        grants = json_data["grants"]
+    except (KeyError, TypeError):
+        grants = []
+    context["worst_grants"] = []
+    for grant_index, messages in CheckFailures(
+        (context.get("quality_accuracy_checks") or []) + (context.get("usefulness_checks") or [])
+    ).worst_grants(10):
+        try:
+            grant_id = grants[grant_index].get("id")
+        except (IndexError, AttributeError, TypeError):
+            grant_id = None
+        context["worst_grants"].append({
+            "index": grant_index,
+            "id": grant_id,
+            "checks": [message["type"] for message in messages],
+        })
+
     # Note if cache is not working the path from submission page to dqt results (new-mode) will not work
     cache.set(pk, context)
 
@@ -37,6 +37,10 @@ SECRET_KEY = settings.SECRET_KEY
 DEBUG = settings.DEBUG
 ALLOWED_HOSTS = settings.ALLOWED_HOSTS
 MAX_XLSX_ROWS = env("MAX_XLSX_ROWS")
+# How many locations are shown for each error, also used to limit how many locations
+# the additional checks keep
+VALIDATION_ERROR_LOCATIONS_LENGTH = settings.VALIDATION_ERROR_LOCATIONS_LENGTH
+VALIDATION_ERROR_LOCATIONS_SAMPLE = settings.VALIDATION_ERROR_LOCATIONS_SAMPLE
 
 MIDDLEWARE = (
     'django.contrib.sessions.middleware.SessionMiddleware',
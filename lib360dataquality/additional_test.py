@@ -1,3 +1,10 @@
+import datetime
+import inspect
+import random
+from array import array
+from collections.abc import Sequence
+
+from dateutil.relativedelta import relativedelta
 from rangedict import RangeDict as range_dict
 from collections import OrderedDict
 
@@ -27,26 +34,355 @@ class TestImportance(object):
     NONE = 0
 
 
+class GrantBitset(object):
+    """A set of grant indexes, stored as one bit for each grant"""
+
+    def __init__(self, indexes=()):
+        self.bits = bytearray()
+        for index in indexes:
+            self.add(index)
+
+    def add(self, index):
+        byte = index >> 3
+        if byte >= len(self.bits):
+            self.bits.extend(bytes(max(byte + 1 - len(self.bits), len(self.bits))))
+        self.bits[byte] |= 1 << (index & 7)
+
+    def update(self, other):
+        if len(other.bits) > len(self.bits):
+            self.bits.extend(bytes(len(other.bits) - len(self.bits)))
+        for byte, value in enumerate(other.bits):
+            if value:
+                self.bits[byte] |= value
+
+    def __contains__(self, index):
+        byte = index >> 3
+        return byte < len(self.bits) and bool(self.bits[byte] & (1 << (index & 7)))
+
+    def __len__(self):
+        return self.as_int().bit_count()
+
+    def __iter__(self):
+        return iter_bits(self.as_int())
+
+    def __eq__(self, other):
+        if isinstance(other, GrantBitset):
+            return self.as_int() == other.as_int()
+        return NotImplemented
+
+    __hash__ = None
+
+    def __repr__(self):
+        return "GrantBitset({!r})".format(list(self))
+
+    def as_int(self):
+        """The set as an int with bit n set for grant n, for combining sets with & and |"""
+        return int.from_bytes(self.bits, "little")
+
+
+def iter_bits(value):
+    """The indexes of the bits set in the int value, in order"""
+    data = value.to_bytes((value.bit_length() + 7) // 8, "little")
+    for byte, bits in enumerate(data):
+        while bits:
+            lowest = bits & -bits
+            yield byte * 8 + lowest.bit_length() - 1
+            bits ^= lowest
+
+
+class JsonLocations(Sequence):
+    """The json locations where a test failed
+
+    Keeps at most limit locations as examples, either the first ones added or if
+    sample is True a random sample of all of them (in the order they were added).
+    total is the number of locations added, including those that weren't kept.
+
+    Locations are stored compactly as the grant's index and an id for the rest of
+    the path, e.g. "grants/12/recipientOrganization/0/id" is 12 and the id of
+    "/recipientOrganization/0/id", and only turned into strings when used.
+    Otherwise it can be used like a list of strings.
+
+    failing_grants is a GrantBitset of the index of every grant with a location
+    added, including those that weren't kept.
+    """
+
+    # The grant index for locations that aren't in a grant
+    NO_GRANT = 0xFFFFFFFF
+
+    def __init__(self, limit=None, sample=False):
+        self.limit = limit
+        self.sample = sample
+        self.total = 0
+        # Seeded so the same data always gives the same examples
+        self.random = random.Random(0) if sample else None
+        self.grant_indexes = array("I")
+        self.suffix_ids = array("I")
+        self.suffixes = []
+        self.suffix_lookup = {}
+        self.failing_grants = GrantBitset()
+
+    def __getstate__(self):
+        # suffix_lookup can be rebuilt from suffixes
+        state = self.__dict__.copy()
+        del state["suffix_lookup"]
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.suffix_lookup = {suffix: suffix_id for suffix_id, suffix in enumerate(self.suffixes)}
+
+    def __len__(self):
+        return len(self.grant_indexes)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self.location(position) for position in range(*index.indices(len(self)))]
+        return self.location(range(len(self))[index])
+
+    def __iter__(self):
+        for position in range(len(self)):
+            yield self.location(position)
+
+    def __eq__(self, other):
+        if isinstance(other, (JsonLocations, list, tuple)):
+            return list(self) == list(other)
+        return NotImplemented
+
+    __hash__ = None
+
+    def __repr__(self):
+        return repr(list(self))
+
+    def location(self, position):
+        grant_index = self.grant_indexes[position]
+        suffix = self.suffixes[self.suffix_ids[position]]
+        if grant_index == self.NO_GRANT:
+            return suffix
+        return "grants/{}{}".format(grant_index, suffix)
+
+    def add(self, grant_index, suffix):
+        """Add the location "grants/<grant_index><suffix>" without building the string"""
+        self.total += 1
+        if grant_index != self.NO_GRANT:
+            self.failing_grants.add(grant_index)
+        if self.limit is None or len(self.grant_indexes) < self.limit:
+            pass
+        elif self.sample:
+            # Reservoir sampling: replace a kept location with probability limit/total
+            index = self.random.randrange(self.total)
+            if index >= self.limit:
+                return
+            del self.grant_indexes[index]
+            del self.suffix_ids[index]
+        else:
+            return
+
+        suffix_id = self.suffix_lookup.get(suffix)
+        if suffix_id is None:
+            suffix_id = self.suffix_lookup[suffix] = len(self.suffixes)
+            self.suffixes.append(suffix)
+        self.grant_indexes.append(grant_index)
+        self.suffix_ids.append(suffix_id)
+
+    def append(self, location):
+        if not isinstance(location, str):
+            self.add(self.NO_GRANT, location)
+            return
+        prefix, _, rest = location.partition("/")
+        grant_index, slash, suffix = rest.partition("/")
+        if prefix == "grants" and grant_index.isascii() and grant_index.isdigit():
+            self.add(int(grant_index), slash + suffix)
+        else:
+            self.add(self.NO_GRANT, location)
+
+    def extend(self, locations):
+        for location in locations:
+            self.append(location)
+
+    def merge(self, other):
+        """Add the locations from other, which were added after the ones in self"""
+        if not isinstance(other, JsonLocations):
+            self.extend(other)
+            return
+
+        if not self.sample or self.limit is None:
+            for grant_index, suffix_id in zip(other.grant_indexes, other.suffix_ids):
+                self.add(grant_index, other.suffixes[suffix_id])
+            self.total += other.total - len(other)
+            self.failing_grants.update(other.failing_grants)
+            return
+
+        total = self.total + other.total
+        size = min(self.limit, len(self) + len(other))
+        # How many of a sample of all the locations would be from self
+        from_self = sum(1 for index in self.random.sample(range(total), size) if index < self.total)
+        from_self = min(from_self, len(self))
+        kept = [
+            (self.grant_indexes[position], self.suffixes[self.suffix_ids[position]])
+            for position in sorted(self.random.sample(range(len(self)), from_self))
+        ]
+        kept.extend(
+            (other.grant_indexes[position], other.suffixes[other.suffix_ids[position]])
+            for position in sorted(self.random.sample(range(len(other)), size - from_self))
+        )
+        del self.grant_indexes[:]
+        del self.suffix_ids[:]
+        for grant_index, suffix in kept:
+            self.add(grant_index, suffix)
+        self.total = total
+        self.failing_grants.update(other.failing_grants)
+
+
+class ReferenceTime(object):
+    """The time that the date checks compare grants' dates against
+
+    One is shared by all of the checks in a run (the reference_time keyword argument)
+    so that every grant is compared against the same time. Pass now to check data as
+    of another time, e.g. when reprocessing old data. The grants' dates don't have a
+    timezone, so a now with one (e.g. "2020-01-01T00:00:00+01:00") is converted to UTC
+    without one.
+    """
+
+    def __init__(self, now=None):
+        now = now or datetime.datetime.now()
+        if now.tzinfo is not None:
+            now = now.astimezone(datetime.timezone.utc).replace(tzinfo=None)
+        self.now = now
+        self.cutoffs = {}
+
+    def years_from_now(self, years):
+        """now + years (negative for the past), worked out once for each number of years"""
+        try:
+            return self.cutoffs[years]
+        except KeyError:
+            cutoff = self.cutoffs[years] = self.now + relativedelta(years=years)
+            return cutoff
+
+
+class VerdictCache(object):
+    """Results of classifying values, e.g. whether an organisation identifier looks valid
+
+    The same identifiers are often in many grants, so each distinct value is only
+    classified once. One is shared by all of the checks in a run (the verdict_cache
+    keyword argument).
+    """
+
+    def __init__(self):
+        self.verdicts = {}
+
+    def verdict(self, classify, value):
+        """classify(value), worked out once for each distinct value
+
+        Values that are equal but of different types, e.g. 1, 1.0 and True, are
+        classified separately, as a classifier may treat them differently.
+        """
+        try:
+            verdicts = self.verdicts[classify]
+        except KeyError:
+            verdicts = self.verdicts[classify] = {}
+        key = (value.__class__, value)
+        try:
+            return verdicts[key]
+        except KeyError:
+            verdict = verdicts[key] = classify(value)
+            return verdict
+        except TypeError:
+            # Not hashable, e.g. a list where a string was expected
+            return classify(value)
+
+
 class AdditionalTest(object):
     category = TestCategories.GRANTS
     importance = TestImportance.NONE
+    # Default to the most common type
+    relevant_grant_type = TestRelevance.RECIPIENT_ANY
+    # Fields (as counted by lib360dataquality/coverage.py e.g. /grants/amountAwarded)
+    # at least one of which a grant must have for this test to fail on it. When none
+    # of them are present in any grant the test can be skipped, see plan_checks()
+    required_fields = []
+    # The most json locations to keep for each test, None for all of them. With
+    # sample_json_locations a random sample is kept instead of the first ones.
+    # Both can be set for a run with the max_json_locations/sample_json_locations
+    # keyword arguments. The count of failing grants is always exact.
+    max_json_locations = None
+    sample_json_locations = False
+    # Whether process() takes the features argument, worked out once for each class
+    process_takes_features = True
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        # Tests written before process() took features don't have it
+        cls.process_takes_features = "features" in inspect.signature(cls.process).parameters
 
     def __init__(self, **kw):
         self.grants = kw["grants"]
         self.aggregates = kw["aggregates"]
         self.grants_percentage = 0
-        self.json_locations = []
+        self.json_locations = JsonLocations(
+            limit=kw.get("max_json_locations", self.max_json_locations),
+            sample=kw.get("sample_json_locations", self.sample_json_locations),
+        )
         self.failed = False
         self.count = 0
         self.heading = None
         self.message = None
-        # Default to the most common type
-        self.relevant_grant_type = TestRelevance.RECIPIENT_ANY
+        # Set when this instance only sees some of the grants and will be merge()d
+        # with the instances that processed the rest, e.g. when run in parallel.
+        # Checks with state across grants can use it to keep what merge() needs.
+        self.keep_merge_state = kw.get("keep_merge_state", False)
+        self.reference_time = kw.get("reference_time") or ReferenceTime()
+        self.verdict_cache = kw.get("verdict_cache") or VerdictCache()
 
-    def process(self, grant, path_prefix):
+    def process(self, grant, path_prefix, features=None):
         # Each test must implement this function which is called on each grant after
         # the class is initialised.
-        # Set self.count, self.failed, self.heading and self.message
+        # features is a GrantFeatures object holding values derived from the grant
+        # that are shared between checks, e.g. features.dates
+        # Set self.count, self.failed and self.json_locations
+        pass
+
+    def process_batch(self, grants, start_index=0, features=None):
+        # process() each of grants, which are numbered from start_index, i.e. the
+        # first one's path_prefix is "grants/<start_index>". features is None or a
+        # list with the GrantFeatures of each grant.
+        # run_extra_checks() calls this with many grants at a time, so a test can
+        # override it to check them together, e.g. with vectorised logic. It must
+        # record the same failures, in the same order, as process() would, as
+        # process() is still used for a grant at a time (e.g. by run_checks()).
+        process = self.process
+        if features is None:
+            for num, grant in enumerate(grants, start_index):
+                process(grant, "grants/{}".format(num))
+        elif self.process_takes_features:
+            for grant, grant_features in zip(grants, features):
+                process(grant, grant_features.path_prefix, grant_features)
+        else:
+            # Tests written before process() took features
+            for grant, grant_features in zip(grants, features):
+                process(grant, grant_features.path_prefix)
+
+    def add_location(self, path_prefix, suffix, features=None):
+        # Record a failure at path_prefix + suffix. The runners pass features with the
+        # grant's index (path_prefix is "grants/<index>") so it can be stored without
+        # building the string.
+        if features is None or features.index is None:
+            self.json_locations.append(path_prefix + suffix)
+        else:
+            self.json_locations.add(features.index, suffix)
+
+    def merge(self, other):
+        # Combine the results of another instance of this test into this one.
+        # other processed the grants that immediately follow the grants this
+        # instance processed. Tests that keep state across grants must override this
+        # so the merged result is the same as processing all of the grants in turn.
+        self.count += other.count
+        self.failed = self.failed or other.failed
+        self.json_locations.merge(other.json_locations)
+
+    def finalize(self):
+        # Called once after every grant has been processed.
+        # Set self.heading and self.message, these only depend on the final count
+        # so there is no need to build them for each grant in process().
         pass
 
     def produce_message(self):
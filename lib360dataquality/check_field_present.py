@@ -1,5 +1,5 @@
 from lib360dataquality.additional_test import AdditionalTest, TestRelevance, RangeDict
-from functools import wraps
+from functools import lru_cache
 
 try:
     from django.utils.html import mark_safe
@@ -10,11 +10,39 @@ except ImportError:
         return string
 
 
+@lru_cache(maxsize=None)
+def compile_field_path(path):
+    """Return a function that gets the value at path in a grant, or None if it isn't there
+
+    path is like FieldNotPresentBase.field, e.g. "beneficiaryLocation/0/geoCode" where
+    numbers are positions in arrays. The path is split once, and the function checks
+    the type of each value on the way instead of catching exceptions, so it is as cheap
+    when the field is missing as when it is present.
+    """
+    keys = tuple(int(part) if part.isascii() and part.isdigit() else part for part in path.strip("/").split("/"))
+
+    def get_field(value):
+        for key in keys:
+            if key.__class__ is int:
+                if not isinstance(value, list) or len(value) <= key:
+                    return None
+                value = value[key]
+            elif isinstance(value, dict):
+                value = value.get(key)
+            else:
+                return None
+        return value
+
+    return get_field
+
+
 class FieldNotPresentBase(AdditionalTest):
     """Checks if any grants do not have a specified field"""
 
     # Field should be overridden and specified as a path
-    # e.g. /awardDate
+    # e.g. beneficiaryLocation/0/geoCode
+    # Unless check_field() is overridden, a grant fails if the value at that path
+    # is missing or empty, see compile_field_path()
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
 
@@ -27,65 +55,112 @@ class FieldNotPresentBase(AdditionalTest):
                 % self.field,
             }
 
-    def process(self, grant, path_prefix):
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        # Only when field is used as a path, some tests that override check_field()
+        # describe what they check in field instead
+        if isinstance(getattr(cls, "field", None), str) and cls.check_field is FieldNotPresentBase.check_field:
+            cls.get_field = staticmethod(compile_field_path(cls.field))
+
+    def check_field(self, grant):
+        return self.get_field(grant)
+
+    def process(self, grant, path_prefix, features=None):
         if not self.field:
             raise Exception("Field to check for not set")
 
         if not self.check_field(grant):
             self.failed = True
             self.count += 1
-            self.json_locations.append(path_prefix + "/id")
+            self.add_location(path_prefix, "/id", features)
 
+    def finalize(self):
         self.heading = self.format_heading_count(self.check_text["heading"], verb="do")
         self.message = self.check_text["message"]
 
 
-# exception to false is a decorator rather than handling it in process()
-# this is so that we don't get strange interactions with @ignore_errors decorator
-# which is already present on the caller of the process function
-def exception_to_false(f):
-    """If the function returns a KeyError or IndexError exception it is treated as false"""
-
-    @wraps(f)
-    def check(self, grant):
-        try:
-            return f(self, grant)
-        except (KeyError, IndexError):
-            return False
-
-    return check
+def field_not_present_test(path, **attributes):
+    """Return a FieldNotPresentBase subclass checking for the field at path
+
+    e.g. field_not_present_test("beneficiaryLocation/0/geoCode") is the same as
+    BeneficiaryLocationGeoCodeNotPresent. attributes are set on the class, e.g. check_text.
+    To be run with workers > 1 the class must be importable, i.e. assigned to the
+    name given by its __name__ in a module.
+    """
+    name = "".join(part[:1].upper() + part[1:] for part in path.strip("/").split("/") if not part.isdigit())
+    return type(name + "NotPresent", (FieldNotPresentBase,), {"field": path, **attributes})
+
+
+def field_not_present_tests(paths, **attributes):
+    """A field_not_present_test() for each of paths"""
+    return [field_not_present_test(path, **attributes) for path in paths]
+
+
+def schema_field_paths(schema):
+    """The paths of the fields in a grant JSON schema, as used by field_not_present_test()
+
+    Objects in arrays are checked in the first item of the array, e.g.
+    "beneficiaryLocation/0/geoCode". Local $refs (e.g. "#/definitions/Organization")
+    are followed, except where they refer back to an object already in the path.
+    """
+    def resolve(subschema, refs):
+        ref = subschema.get("$ref")
+        if ref is None:
+            return subschema, refs
+        if ref in refs or not ref.startswith("#/"):
+            return None, refs
+        target = schema
+        for part in ref[2:].split("/"):
+            target = target.get(part, {})
+        return resolve(target, refs | {ref})
+
+    def types(subschema):
+        schema_type = subschema.get("type", [])
+        return {schema_type} if isinstance(schema_type, str) else set(schema_type)
+
+    def walk(subschema, prefix, refs):
+        for name, property_schema in subschema.get("properties", {}).items():
+            property_schema, property_refs = resolve(property_schema, refs)
+            if property_schema is None:
+                continue
+            path = prefix + name
+            if "array" in types(property_schema):
+                items, item_refs = resolve(property_schema.get("items", {}), property_refs)
+                if items is not None and items.get("properties"):
+                    yield from walk(items, path + "/0/", item_refs)
+                    continue
+            elif property_schema.get("properties"):
+                yield from walk(property_schema, path + "/", property_refs)
+                continue
+            yield path
+
+    return list(walk(schema, "", frozenset()))
+
+
+def field_not_present_tests_from_schema(schema, **attributes):
+    """A field_not_present_test() for each of the fields in a grant JSON schema, see schema_field_paths()"""
+    return field_not_present_tests(schema_field_paths(schema), **attributes)
 
 
 class ClassificationNotPresent(FieldNotPresentBase):
     field = "classifications/0/title"
 
-    @exception_to_false
-    def check_field(self, grant):
-        return grant["classifications"][0]["title"]
-
 
 class BeneficiaryLocationNameNotPresent(FieldNotPresentBase):
     field = "beneficiaryLocation/0/name"
 
-    @exception_to_false
-    def check_field(self, grant):
-        return grant["beneficiaryLocation"][0]["name"]
-
 
 class BeneficiaryLocationCountryCodeNotPresent(FieldNotPresentBase):
     field = "beneficiaryLocation/0/countryCode"
 
-    @exception_to_false
-    def check_field(self, grant):
-        return grant["beneficiaryLocation"][0]["countryCode"]
-
 
 class BeneficiaryLocationGeoCodeNotPresent(FieldNotPresentBase):
     field = "beneficiaryLocation/0/geoCode"
 
-    @exception_to_false
-    def check_field(self, grant):
-        return grant["beneficiaryLocation"][0]["geoCode"]
+
+get_planned_duration = compile_field_path("plannedDates/0/duration")
+get_planned_start_date = compile_field_path("plannedDates/0/startDate")
+get_planned_end_date = compile_field_path("plannedDates/0/endDate")
 
 
 class PlannedDurationNotPresent(FieldNotPresentBase):
@@ -106,13 +181,10 @@ class PlannedDurationNotPresent(FieldNotPresentBase):
         "plannedDates/0/duration or (plannedDates/startDate and plannedDates/endDate)"
     )
 
-    @exception_to_false
     def check_field(self, grant):
-        return (grant["plannedDates"][0].get("duration") is not None or (grant["plannedDates"][0].get("startDate") and grant["plannedDates"][0].get("endDate")))
-
-    def process(self, grant, path_prefix):
-        super().process(grant, path_prefix)
+        return get_planned_duration(grant) is not None or (get_planned_start_date(grant) and get_planned_end_date(grant))
 
+    def finalize(self):
         self.heading = mark_safe(self.format_heading_count(self.check_text["heading"]))
         self.message = self.check_text["message"][self.grants_percentage]
 
@@ -120,19 +192,14 @@ class PlannedDurationNotPresent(FieldNotPresentBase):
 class GrantProgrammeTitleNotPresent(FieldNotPresentBase):
     field = "grantProgramme/0/title"
 
-    @exception_to_false
-    def check_field(self, grant):
-        return grant["grantProgramme"][0]["title"]
-
 
 class IndividualsCodeListsNotPresent(FieldNotPresentBase):
     field = (
         "toIndividualsDetails/grantPurpose or toIndividualsDetails/primaryGrantReason"
     )
 
-    def __init__(self, **kwargs):
-        super().__init__(**kwargs)
-        self.relevant_grant_type = TestRelevance.RECIPIENT_INDIVIDUAL
+    relevant_grant_type = TestRelevance.RECIPIENT_INDIVIDUAL
+    required_fields = ["/grants/recipientIndividual"]
 
     def check_field(self, grant):
         # Not relevant
@@ -1,21 +1,29 @@
+import contextlib
 import datetime
 import functools
 import itertools
 import json
 import re
-from collections import OrderedDict, defaultdict
+import time
+from collections import Counter, defaultdict
+from concurrent.futures import ProcessPoolExecutor
 from decimal import Decimal
 import logging
 
+import ijson
 import libcove.lib.tools as tools
 import openpyxl
 import pytz
-from dateutil.relativedelta import relativedelta
 from jsonschema.exceptions import ValidationError
 from libcove.lib.common import common_checks_context, get_additional_codelist_values, get_orgids_prefixes, validator
 from libcove.lib.tools import decimal_default
-from lib360dataquality.additional_test import AdditionalTest, TestImportance, TestType, TestCategories, TestRelevance, RangeDict
+from lib360dataquality.additional_test import (
+    AdditionalTest, TestImportance, TestType, TestCategories, TestRelevance, RangeDict, ReferenceTime, VerdictCache,
+    JsonLocations, iter_bits,
+)
 from lib360dataquality.check_field_present import PlannedDurationNotPresent
+from lib360dataquality.coverage import grant_unique_fields_present
+from lib360dataquality.sketches import HyperLogLog, IdHashes, QuantileSketch, hash64
 
 try:
     from django.utils.html import mark_safe
@@ -25,6 +33,12 @@ except ImportError:
     def mark_safe(string):
         return string
 
+try:
+    import numpy
+except ImportError:
+    # Without numpy (see the perf extra in setup.py) every check is run a grant at a time
+    numpy = None
+
 logger = logging.getLogger(__name__)
 
 DATES_JSON_LOCATION = {
@@ -129,112 +143,308 @@ def oneOf_draft4(validator, oneOf, instance, schema):
 validator.VALIDATORS["oneOf"] = oneOf_draft4
 
 
+def repeated_values(values):
+    """Return a set of the values that are in values more than once
+
+    Treats values as equal in the same way as a set. With numpy the values are found
+    by sorting an array of their hashes, only comparing the values themselves where
+    the hashes are the same, which uses much less memory than a set of the values.
+    """
+    if numpy is None:
+        seen = set()
+        repeated = set()
+        for value in values:
+            if value in seen:
+                repeated.add(value)
+            else:
+                seen.add(value)
+        return repeated
+
+    hashes = numpy.fromiter(map(hash, values), dtype=numpy.int64, count=len(values))
+    order = numpy.argsort(hashes)
+    sorted_hashes = hashes[order]
+    same_as_next = numpy.flatnonzero(sorted_hashes[1:] == sorted_hashes[:-1])
+    del sorted_hashes
+    # Almost always the values with the same hash are the same value, but check
+    repeated = set()
+    seen = {}
+    for index in order[numpy.union1d(same_as_next, same_as_next + 1)].tolist():
+        value = values[index]
+        same_hash = seen.setdefault(int(hashes[index]), [])
+        if value in same_hash:
+            repeated.add(value)
+        else:
+            same_hash.append(value)
+    return repeated
+
+
+class GrantsAggregator(object):
+    """Accumulates the grants aggregates one grant at a time
+
+    process() is called on each grant and produce_aggregates() once all of the
+    grants have been seen. This lets the aggregates be gathered in the same pass
+    over the grants as the additional checks (see run_checks).
+
+    Aggregators for separate parts of the data, e.g. shards of a file or the files in
+    a corpus, can be combined with merge(), giving the same aggregates as one
+    aggregator that processed all of the grants.
+
+    With approximate_distinct, for very large amounts of data, the distinct grant and
+    org ids are counted with HyperLogLog sketches instead of being kept in sets. The
+    aggregates then have unique_ids_count, distinct_funding_org_identifier_count and
+    distinct_recipient_org_identifier_count (with a relative standard error of
+    distinct_count_error), and duplicate_ids_count from the hash of each grant id,
+    instead of the sets and the org id prefixes.
+
+    The aggregates for each currency include estimates of quantiles of the amounts
+    (see amount_quantiles) from a QuantileSketch, which are within 1% of the true
+    amounts. As for min_amount, amounts of 0 aren't included.
+    """
+
+    # Key in each currency's aggregates to the quantile of the amounts awarded
+    amount_quantiles = {"p50_amount": 0.5, "p90_amount": 0.9, "p99_amount": 0.99}
+
+    def __init__(self, approximate_distinct=False):
+        self.approximate_distinct = approximate_distinct
+        self.id_count = 0
+        self.count = 0
+        if approximate_distinct:
+            self.unique_ids = HyperLogLog()
+            self.id_hashes = IdHashes()
+            self.distinct_funding_org_identifier = HyperLogLog()
+            self.distinct_recipient_org_identifier = HyperLogLog()
+        else:
+            # Every grant id, the distinct and duplicate ids are found at the end
+            self.grant_ids = []
+            self.distinct_funding_org_identifier = set()
+            self.distinct_recipient_org_identifier = set()
+        self.max_award_date = ""
+        self.min_award_date = ""
+        self.award_years = {}
+        self.currencies = {}
+        # Currency to a QuantileSketch of the amounts
+        self.amount_sketches = {}
+        self.recipient_individuals_count = 0
+
+    def process(self, grant):
+        self.count = self.count + 1
+        currency = grant.get("currency")
+        currencies = self.currencies
+
+        if currency not in currencies.keys():
+            currencies[currency] = {
+                "count": 0,
+                "total_amount": 0,
+                "max_amount": 0,
+                "min_amount": 0,
+                "currency_symbol": currency_html.get(currency, ""),
+            }
+            self.amount_sketches[currency] = QuantileSketch()
+
+        currencies[currency]["count"] += 1
+        amount_awarded = grant.get("amountAwarded")
+        if amount_awarded and isinstance(amount_awarded, (int, Decimal, float)):
+            currencies[currency]["total_amount"] += amount_awarded
+            self.amount_sketches[currency].add(amount_awarded)
+            currencies[currency]["max_amount"] = max(
+                amount_awarded, currencies[currency]["max_amount"]
+            )
+            if not currencies[currency]["min_amount"]:
+                currencies[currency]["min_amount"] = amount_awarded
+            currencies[currency]["min_amount"] = min(
+                amount_awarded, currencies[currency]["min_amount"]
+            )
+
+        award_date = str(grant.get("awardDate", ""))
+        if award_date:
+            try:
+                year = award_date[:4]
+                # count up the tally of grants in `year`
+                self.award_years[year] = self.award_years[year] + 1
+            except KeyError:
+                self.award_years[year] = 1
+            self.max_award_date = max(award_date, self.max_award_date)
+            if not self.min_award_date:
+                self.min_award_date = award_date
+            self.min_award_date = min(award_date, self.min_award_date)
+
+        grant_id = grant.get("id")
+        if grant_id:
+            self.id_count = self.id_count + 1
+            if self.approximate_distinct:
+                hashed = hash64(grant_id)
+                self.id_hashes.add_hash(hashed)
+                self.unique_ids.add_hash(hashed)
+            else:
+                self.grant_ids.append(grant_id)
+
+        funding_orgs = grant.get("fundingOrganization", [])
+        for funding_org in funding_orgs:
+            funding_org_id = funding_org.get("id")
+            if funding_org_id:
+                self.distinct_funding_org_identifier.add(funding_org_id)
+
+        recipient_orgs = grant.get("recipientOrganization", [])
+        for recipient_org in recipient_orgs:
+            recipient_org_id = recipient_org.get("id")
+            if recipient_org_id:
+                self.distinct_recipient_org_identifier.add(recipient_org_id)
+
+        if grant.get("recipientIndividual", None):
+            self.recipient_individuals_count += 1
+
+    def merge(self, other):
+        """Add the grants processed by other, which came after those processed by self"""
+        self.count += other.count
+        self.id_count += other.id_count
+        self.recipient_individuals_count += other.recipient_individuals_count
+
+        if self.approximate_distinct:
+            self.merge_distinct_approximately(other)
+        elif other.approximate_distinct:
+            raise ValueError("Can't merge an approximate_distinct GrantsAggregator into an exact one")
+        else:
+            self.grant_ids.extend(other.grant_ids)
+            self.distinct_funding_org_identifier |= other.distinct_funding_org_identifier
+            self.distinct_recipient_org_identifier |= other.distinct_recipient_org_identifier
+
+        for year, count in other.award_years.items():
+            self.award_years[year] = self.award_years.get(year, 0) + count
+        self.max_award_date = max(self.max_award_date, other.max_award_date)
+        # "" is unset, as in process()
+        if other.min_award_date:
+            self.min_award_date = min(self.min_award_date or other.min_award_date, other.min_award_date)
+
+        for currency, other_currency in other.currencies.items():
+            if currency not in self.currencies:
+                self.currencies[currency] = dict(other_currency)
+                continue
+            currency_aggregates = self.currencies[currency]
+            currency_aggregates["count"] += other_currency["count"]
+            currency_aggregates["total_amount"] += other_currency["total_amount"]
+            currency_aggregates["max_amount"] = max(currency_aggregates["max_amount"], other_currency["max_amount"])
+            # 0 is unset, as in process() (which skips amounts of 0)
+            if other_currency["min_amount"]:
+                currency_aggregates["min_amount"] = min(
+                    currency_aggregates["min_amount"] or other_currency["min_amount"], other_currency["min_amount"]
+                )
+        for currency, sketch in other.amount_sketches.items():
+            self.amount_sketches.setdefault(currency, QuantileSketch()).merge(sketch)
+
+    def merge_distinct_approximately(self, other):
+        if other.approximate_distinct:
+            self.id_hashes.merge(other.id_hashes)
+            self.unique_ids.merge(other.unique_ids)
+            self.distinct_funding_org_identifier.merge(other.distinct_funding_org_identifier)
+            self.distinct_recipient_org_identifier.merge(other.distinct_recipient_org_identifier)
+            return
+        for hashed in map(hash64, other.grant_ids):
+            self.id_hashes.add_hash(hashed)
+            self.unique_ids.add_hash(hashed)
+        for org_id in other.distinct_funding_org_identifier:
+            self.distinct_funding_org_identifier.add(org_id)
+        for org_id in other.distinct_recipient_org_identifier:
+            self.distinct_recipient_org_identifier.add(org_id)
+
+    def currencies_aggregates(self):
+        currencies = {}
+        for currency, currency_aggregates in self.currencies.items():
+            currencies[currency] = dict(currency_aggregates)
+            for key, quantile in self.amount_quantiles.items():
+                amount = self.amount_sketches[currency].quantile(quantile)
+                currencies[currency][key] = None if amount is None else round(amount, 2)
+        return currencies
+
+    def produce_approximate_aggregates(self):
+        return {
+            "count": self.count,
+            "id_count": self.id_count,
+            "unique_ids_count": len(self.unique_ids),
+            "duplicate_ids_count": len(self.id_hashes.repeated()),
+            "max_award_date": self.max_award_date.split("T")[0],
+            "min_award_date": self.min_award_date.split("T")[0],
+            "award_years": self.award_years,
+            "distinct_funding_org_identifier_count": len(self.distinct_funding_org_identifier),
+            "distinct_recipient_org_identifier_count": len(self.distinct_recipient_org_identifier),
+            "distinct_count_error": self.unique_ids.relative_error,
+            "recipient_individuals_count": self.recipient_individuals_count,
+            "currencies": self.currencies_aggregates(),
+        }
+
+    def produce_aggregates(self):
+        if self.approximate_distinct:
+            return self.produce_approximate_aggregates()
+        # The repeated ids first, so their working arrays are freed before the set is made
+        duplicate_ids = repeated_values(self.grant_ids)
+        unique_ids = set(self.grant_ids)
+
+        recipient_org_prefixes = get_prefixes(self.distinct_recipient_org_identifier)
+        recipient_org_identifier_prefixes = recipient_org_prefixes["prefixes"]
+        recipient_org_identifiers_unrecognised_prefixes = recipient_org_prefixes[
+            "unrecognised_prefixes"
+        ]
+
+        funding_org_prefixes = get_prefixes(self.distinct_funding_org_identifier)
+        funding_org_identifier_prefixes = funding_org_prefixes["prefixes"]
+        funding_org_identifiers_unrecognised_prefixes = funding_org_prefixes[
+            "unrecognised_prefixes"
+        ]
+
+        return {
+            "count": self.count,
+            "id_count": self.id_count,
+            "unique_ids": unique_ids,
+            "duplicate_ids": duplicate_ids,
+            "max_award_date": self.max_award_date.split("T")[0],
+            "min_award_date": self.min_award_date.split("T")[0],
+            "award_years": self.award_years,
+            "distinct_funding_org_identifier": self.distinct_funding_org_identifier,
+            "distinct_recipient_org_identifier": self.distinct_recipient_org_identifier,
+            "recipient_individuals_count": self.recipient_individuals_count,
+            "currencies": self.currencies_aggregates(),
+            "recipient_org_identifier_prefixes": recipient_org_identifier_prefixes,
+            "recipient_org_identifiers_unrecognised_prefixes": recipient_org_identifiers_unrecognised_prefixes,
+            "funding_org_identifier_prefixes": funding_org_identifier_prefixes,
+            "funding_org_identifiers_unrecognised_prefixes": funding_org_identifiers_unrecognised_prefixes,
+        }
+
+
 @tools.ignore_errors
 def get_grants_aggregates(json_data):
-
-    id_count = 0
-    count = 0
-    unique_ids = set()
-    duplicate_ids = set()
-    max_award_date = ""
-    min_award_date = ""
-    award_years = {}
-    distinct_funding_org_identifier = set()
-    distinct_recipient_org_identifier = set()
-    currencies = {}
-    recipient_individuals_count = 0
+    aggregator = GrantsAggregator()
 
     if "grants" in json_data:
         for grant in json_data["grants"]:
-            count = count + 1
-            currency = grant.get("currency")
-
-            if currency not in currencies.keys():
-                currencies[currency] = {
-                    "count": 0,
-                    "total_amount": 0,
-                    "max_amount": 0,
-                    "min_amount": 0,
-                    "currency_symbol": currency_html.get(currency, ""),
-                }
-
-            currencies[currency]["count"] += 1
-            amount_awarded = grant.get("amountAwarded")
-            if amount_awarded and isinstance(amount_awarded, (int, Decimal, float)):
-                currencies[currency]["total_amount"] += amount_awarded
-                currencies[currency]["max_amount"] = max(
-                    amount_awarded, currencies[currency]["max_amount"]
-                )
-                if not currencies[currency]["min_amount"]:
-                    currencies[currency]["min_amount"] = amount_awarded
-                currencies[currency]["min_amount"] = min(
-                    amount_awarded, currencies[currency]["min_amount"]
-                )
+            aggregator.process(grant)
 
-            award_date = str(grant.get("awardDate", ""))
-            if award_date:
-                try:
-                    year = award_date[:4]
-                    # count up the tally of grants in `year`
-                    award_years[year] = award_years[year] + 1
-                except KeyError:
-                    award_years[year] = 1
-                max_award_date = max(award_date, max_award_date)
-                if not min_award_date:
-                    min_award_date = award_date
-                min_award_date = min(award_date, min_award_date)
-
-            grant_id = grant.get("id")
-            if grant_id:
-                id_count = id_count + 1
-                if grant_id in unique_ids:
-                    duplicate_ids.add(grant_id)
-                unique_ids.add(grant_id)
-
-            funding_orgs = grant.get("fundingOrganization", [])
-            for funding_org in funding_orgs:
-                funding_org_id = funding_org.get("id")
-                if funding_org_id:
-                    distinct_funding_org_identifier.add(funding_org_id)
-
-            recipient_orgs = grant.get("recipientOrganization", [])
-            for recipient_org in recipient_orgs:
-                recipient_org_id = recipient_org.get("id")
-                if recipient_org_id:
-                    distinct_recipient_org_identifier.add(recipient_org_id)
-
-            if grant.get("recipientIndividual", None):
-                recipient_individuals_count += 1
-
-    recipient_org_prefixes = get_prefixes(distinct_recipient_org_identifier)
-    recipient_org_identifier_prefixes = recipient_org_prefixes["prefixes"]
-    recipient_org_identifiers_unrecognised_prefixes = recipient_org_prefixes[
-        "unrecognised_prefixes"
-    ]
+    return aggregator.produce_aggregates()
 
-    funding_org_prefixes = get_prefixes(distinct_funding_org_identifier)
-    funding_org_identifier_prefixes = funding_org_prefixes["prefixes"]
-    funding_org_identifiers_unrecognised_prefixes = funding_org_prefixes[
-        "unrecognised_prefixes"
-    ]
 
-    return {
-        "count": count,
-        "id_count": id_count,
-        "unique_ids": unique_ids,
-        "duplicate_ids": duplicate_ids,
-        "max_award_date": max_award_date.split("T")[0],
-        "min_award_date": min_award_date.split("T")[0],
-        "award_years": award_years,
-        "distinct_funding_org_identifier": distinct_funding_org_identifier,
-        "distinct_recipient_org_identifier": distinct_recipient_org_identifier,
-        "recipient_individuals_count": recipient_individuals_count,
-        "currencies": currencies,
-        "recipient_org_identifier_prefixes": recipient_org_identifier_prefixes,
-        "recipient_org_identifiers_unrecognised_prefixes": recipient_org_identifiers_unrecognised_prefixes,
-        "funding_org_identifier_prefixes": funding_org_identifier_prefixes,
-        "funding_org_identifiers_unrecognised_prefixes": funding_org_identifiers_unrecognised_prefixes,
-    }
+def iter_grants_from_file(path, use_float=False):
+    """The grants in the 360Giving JSON file at path, read one at a time with ijson
+
+    ijson uses its fastest backend that is installed, preferably the C (yajl2_c) one.
+    Numbers that aren't integers are Decimals, as json.load(..., parse_float=Decimal),
+    or floats with use_float as json.load gives.
+    """
+    with open(path, "rb") as fp:
+        yield from ijson.items(fp, "grants.item", use_float=use_float)
+
+
+@tools.ignore_errors
+def get_grants_aggregates_from_file(path, use_float=False, aggregator=None):
+    """The same as get_grants_aggregates for the data in the JSON file at path, but
+    reading the grants one at a time so the whole file isn't in memory at once
+
+    aggregator: the GrantsAggregator to use, e.g. to merge() it into another after.
+    """
+    if aggregator is None:
+        aggregator = GrantsAggregator()
+
+    for grant in iter_grants_from_file(path, use_float):
+        aggregator.process(grant)
+
+    return aggregator.produce_aggregates()
 
 
 def group_validation_errors(validation_errors, file_type, openpyxl_workbook):
@@ -362,6 +572,9 @@ def common_checks_360(
     json_data,
     schema_obj,
     test_classes=None,
+    timings=False,
+    test_options=None,
+    workers=1,
 ):
     """Data Quality Checks for 360Giving packaged data
     context: dictionary to update with results. Must contain "file_type" key.
@@ -369,12 +582,22 @@ def common_checks_360(
     json_data: { grants: [,,] }
     schema_obj: See lib360dataQuality/cove/schema.py for Schema360
     test_classes: array of test functions to run. Defaults to all available if None.
+    timings: if True add the time spent in each check and stage to context["timings"], see CheckTimings
+    test_options: dict of keyword arguments for each of the tests, e.g. max_json_locations, or
+    reference_time: a ReferenceTime to check the dates as of another time (defaults to now)
+    workers: if more than 1 the additional checks are run in that many processes, see
+    run_checks_over_grants. This starts a process pool, so it is for command line
+    tools such as tools/cove_checks.py rather than for use within a web request.
     """
+    # Timing the stages is cheap so is always done, the checks are only timed if asked
+    check_timings = CheckTimings()
+    stage = check_timings.stage
 
     schema_name = schema_obj.pkg_schema_name
-    common_checks = common_checks_context(
-        upload_dir, json_data, schema_obj, schema_name, context
-    )
+    with stage("common_checks_context"):
+        common_checks = common_checks_context(
+            upload_dir, json_data, schema_obj, schema_name, context
+        )
     cell_source_map = common_checks["cell_source_map"]
 
     # If no particular test classes are supplied then run all defined here
@@ -391,10 +614,26 @@ def common_checks_360(
     else:
         openpyxl_workbook = None
 
+    # Gather the aggregates and run every group of additional checks in one pass over the grants
+    grants_aggregates, extra_checks_results = run_checks(
+        json_data,
+        cell_source_map,
+        {test_class_type: TEST_CLASSES[test_class_type] for test_class_type in test_classes},
+        # Set ignore_errors to False for debugging checks otherwise all exceptions will pass
+        ignore_errors=True,
+        timings=check_timings if timings else None,
+        test_options=test_options,
+        workers=workers,
+    )
+
     context.update(common_checks["context"])
+    with stage("group_validation_errors"):
+        validation_errors_grouped = group_validation_errors(
+            context["validation_errors"], context["file_type"], openpyxl_workbook
+        )
     context.update(
         {
-            "grants_aggregates": get_grants_aggregates(json_data, ignore_errors=True),
+            "grants_aggregates": grants_aggregates,
             "common_error_types": [
                 "uri",
                 "date-time",
@@ -404,32 +643,14 @@ def common_checks_360(
                 "string",
                 "minimum",
             ],
-            "validation_errors_grouped": group_validation_errors(
-                context["validation_errors"], context["file_type"], openpyxl_workbook
-            ),
+            "validation_errors_grouped": validation_errors_grouped,
         }
     )
 
-    for test_class_type in test_classes:
-        extra_checks = run_extra_checks(
-            json_data,
-            cell_source_map,
-            TEST_CLASSES[test_class_type],
-            # Set ignore_errors to False for debugging checks otherwise all exceptions will pass
-            ignore_errors=True,
-            return_on_error=None,
-            aggregates=context["grants_aggregates"],
-        )
-
-        context.update(
-            {
-                "{}_errored".format(test_class_type): extra_checks is None,
-                "{}_checks".format(test_class_type): extra_checks,
-                "{}_checks_count".format(test_class_type): len(extra_checks) if extra_checks else 0
-            }
-        )
+    context.update(extra_checks_context(extra_checks_results))
 
-    additional_codelist_values = get_additional_codelist_values(schema_obj, json_data)
+    with stage("get_additional_codelist_values"):
+        additional_codelist_values = get_additional_codelist_values(schema_obj, json_data)
     closed_codelist_values = {
         key: value for key, value in additional_codelist_values.items() if not value["isopen"]
     }
@@ -445,19 +666,128 @@ def common_checks_360(
         }
     )
 
+    if timings:
+        context["timings"] = check_timings.as_dict()
+
     return context
 
 
+def extra_checks_context(extra_checks_results):
+    """Context for the results of run_checks for each test class type"""
+    context = {}
+    for test_class_type, extra_checks in extra_checks_results.items():
+        context.update(
+            {
+                "{}_errored".format(test_class_type): extra_checks is None,
+                "{}_checks".format(test_class_type): extra_checks,
+                "{}_checks_count".format(test_class_type): len(extra_checks) if extra_checks else 0
+            }
+        )
+    return context
+
+
+def stream_checks_360(fp, test_classes=None, timings=False, test_options=None):
+    """Data Quality Checks for 360Giving JSON that is too large to load into memory
+    fp: the JSON file, opened in binary mode
+    test_classes, timings, test_options: as for common_checks_360
+
+    The grants are read one at a time with ijson so memory use depends on the state
+    the checks keep rather than the size of the file. Only the grants aggregates,
+    additional checks and field coverage ("fields_present") are produced, in the same
+    context keys as common_checks_360 uses. Schema validation needs the whole package
+    in memory so isn't run. This is for tools/cove_checks.py --stream, the web app
+    loads the whole file as it also validates, converts and displays the data.
+
+    Raises ValueError if the file isn't well formed JSON, as json.load() does, even if
+    that is only found after some of the grants have been checked.
+    """
+    if test_classes is None:
+        test_classes = [TestType.QUALITY_TEST_CLASS, TestType.USEFULNESS_TEST_CLASS]
+
+    check_timings = CheckTimings() if timings else None
+    fields_present = Counter()
+
+    def grants():
+        # Numbers that aren't integers are parsed as Decimal, as json.load(..., parse_float=Decimal)
+        for grant in ijson.items(fp, "grants.item"):
+            fields_present.update(grant_unique_fields_present(grant))
+            yield grant
+
+    try:
+        grants_aggregates, extra_checks_results = run_checks_over_grants(
+            grants(),
+            {},
+            {test_class_type: TEST_CLASSES[test_class_type] for test_class_type in test_classes},
+            ignore_errors=True,
+            timings=check_timings,
+            test_options=test_options,
+        )
+    except ijson.JSONError as err:
+        raise ValueError("The file is not well formed JSON: {}".format(err)) from err
+
+    context = {
+        "grants_aggregates": grants_aggregates,
+        "fields_present": dict(fields_present),
+    }
+    context.update(extra_checks_context(extra_checks_results))
+    if timings:
+        context["timings"] = check_timings.as_dict()
+    return context
+
+
+class PrefixTrie(object):
+    """Finds which of a list of prefixes a string starts with
+
+    Built once from the prefixes, so matching a string only looks at as many of its
+    characters as the longest prefix rather than trying every prefix in turn.
+    With ignore_case the prefixes and strings are compared lower cased.
+    """
+
+    # Key in a node for the position in prefixes of the prefix that ends there
+    END = None
+
+    def __init__(self, prefixes, ignore_case=False):
+        self.prefixes = list(prefixes)
+        self.ignore_case = ignore_case
+        self.root = {}
+        for index, prefix in enumerate(self.prefixes):
+            if ignore_case:
+                prefix = prefix.lower()
+            node = self.root
+            for char in prefix:
+                node = node.setdefault(char, {})
+            # Keep the first if a prefix is in the list twice
+            node.setdefault(self.END, index)
+
+    def match(self, string):
+        """The first prefix in the list that string starts with, or None if none do"""
+        if self.ignore_case:
+            string = string.lower()
+        node = self.root
+        first = node.get(self.END)
+        for char in string:
+            node = node.get(char)
+            if node is None:
+                break
+            index = node.get(self.END)
+            if index is not None and (first is None or index < first):
+                first = index
+        return None if first is None else self.prefixes[first]
+
+
+orgids_prefix_trie = PrefixTrie(orgids_prefixes)
+orgids_prefix_trie_ignore_case = PrefixTrie(orgids_prefixes, ignore_case=True)
+
+
 def get_prefixes(distinct_identifiers):
 
     org_identifier_prefixes = defaultdict(int)
     org_identifiers_unrecognised_prefixes = defaultdict(int)
 
     for org_identifier in distinct_identifiers:
-        for prefix in orgids_prefixes:
-            if org_identifier.startswith(prefix):
-                org_identifier_prefixes[prefix] += 1
-                break
+        prefix = orgids_prefix_trie.match(org_identifier)
+        if prefix is not None:
+            org_identifier_prefixes[prefix] += 1
         else:
             org_identifiers_unrecognised_prefixes[org_identifier] += 1
 
@@ -489,6 +819,42 @@ def check_company_number(company_number):
     return company_pattern_re.match(company_number) is not None
 
 
+# Classifications of the organisation identifiers and numbers, for use with
+# AdditionalTest.verdict_cache so each distinct value is only looked at once
+
+
+def org_id_starts_360g(org_id):
+    return org_id.lower().startswith("360g")
+
+
+def org_id_has_unrecognised_prefix(org_id):
+    return orgids_prefix_trie_ignore_case.match(org_id) is None
+
+
+def org_id_has_unexpected_chars(org_id):
+    return "\n" in org_id
+
+
+def org_id_looks_invalid(org_id):
+    """Whether a GB-CHC- or GB-COH- identifier doesn't look like a charity or company number"""
+    if org_id.upper().startswith("GB-CHC-"):
+        return not check_charity_number(org_id[7:])
+    elif org_id.upper().startswith("GB-COH-"):
+        return not check_company_number(org_id[7:])
+    return False
+
+
+def charity_number_looks_invalid(charity_number):
+    """charity_number may start with two letters"""
+    if charity_number[:2].isalpha():
+        charity_number = charity_number[2:]
+    return not check_charity_number(charity_number)
+
+
+def company_number_looks_invalid(company_number):
+    return not check_company_number(company_number)
+
+
 def flatten_dict(grant, path=""):
     for key, value in sorted(grant.items()):
         if isinstance(value, list):
@@ -521,19 +887,24 @@ class ZeroAmountTest(AdditionalTest):
 
     category = TestCategories.GRANTS
     importance = TestImportance.CRITICAL
+    required_fields = ["/grants/amountAwarded"]
 
-    def process(self, grant, path_prefix):
+    def process(self, grant, path_prefix, features=None):
         try:
             # check for == 0 explicitly, as other falsey values will be caught
             # by schema validation, and also showing a message about 0 value
             # grants would be more confusing
             if grant["amountAwarded"] == 0:
                 self.failed = True
-                self.json_locations.append(path_prefix + "/amountAwarded")
+                self.add_location(path_prefix, "/amountAwarded", features)
                 self.count += 1
         except KeyError:
             pass
 
+    def process_columns(self, columns):
+        add_column_failures(self, columns, [("/amountAwarded", columns.amounts == 0)])
+
+    def finalize(self):
         self.heading = mark_safe(
             self.format_heading_count(
                 self.check_text["heading"], test_class_type=TestType.QUALITY_TEST_CLASS
@@ -565,23 +936,20 @@ class RecipientOrg360GPrefix(AdditionalTest):
     )
 
     category = TestCategories.ORGANISATIONS
+    relevant_grant_type = TestRelevance.RECIPIENT_ORGANISATION
+    required_fields = ["/grants/recipientOrganization/id"]
 
-    def __init__(self, **kwargs):
-        super().__init__(**kwargs)
-        self.relevant_grant_type = TestRelevance.RECIPIENT_ORGANISATION
-
-    def process(self, grant, path_prefix):
+    def process(self, grant, path_prefix, features=None):
         try:
             for num, organization in enumerate(grant["recipientOrganization"]):
-                if organization["id"].lower().startswith("360g"):
+                if self.verdict_cache.verdict(org_id_starts_360g, organization["id"]):
                     self.failed = True
-                    self.json_locations.append(
-                        path_prefix + "/recipientOrganization/{}/id".format(num)
-                    )
+                    self.add_location(path_prefix, "/recipientOrganization/{}/id".format(num), features)
                     self.count += 1
         except KeyError:
             pass
 
+    def finalize(self):
         self.heading = mark_safe(self.format_heading_count(self.check_text["heading"]))
         self.message = self.check_text["message"][self.grants_percentage]
 
@@ -605,19 +973,19 @@ class FundingOrg360GPrefix(AdditionalTest):
     )
 
     category = TestCategories.ORGANISATIONS
+    required_fields = ["/grants/fundingOrganization/id"]
 
-    def process(self, grant, path_prefix):
+    def process(self, grant, path_prefix, features=None):
         try:
             for num, organization in enumerate(grant["fundingOrganization"]):
-                if organization["id"].lower().startswith("360g"):
+                if self.verdict_cache.verdict(org_id_starts_360g, organization["id"]):
                     self.failed = True
-                    self.json_locations.append(
-                        path_prefix + "/fundingOrganization/{}/id".format(num)
-                    )
+                    self.add_location(path_prefix, "/fundingOrganization/{}/id".format(num), features)
                     self.count += 1
         except KeyError:
             pass
 
+    def finalize(self):
         self.heading = mark_safe(self.format_heading_count(self.check_text["heading"]))
         self.message = self.check_text["message"][self.grants_percentage]
 
@@ -639,30 +1007,24 @@ class RecipientOrgUnrecognisedPrefix(AdditionalTest):
     )
 
     category = TestCategories.ORGANISATIONS
+    relevant_grant_type = TestRelevance.RECIPIENT_ORGANISATION
+    required_fields = ["/grants/recipientOrganization/id"]
 
-    def __init__(self, **kwargs):
-        super().__init__(**kwargs)
-        self.relevant_grant_type = TestRelevance.RECIPIENT_ORGANISATION
-
-    def process(self, grant, path_prefix):
+    def process(self, grant, path_prefix, features=None):
         try:
             count_failure = False
             for num, organization in enumerate(grant["recipientOrganization"]):
-                for prefix in orgids_prefixes:
-                    if organization["id"].lower().startswith(prefix.lower()):
-                        break
-                else:
+                if self.verdict_cache.verdict(org_id_has_unrecognised_prefix, organization["id"]):
                     self.failed = True
                     count_failure = True
-                    self.json_locations.append(
-                        path_prefix + "/recipientOrganization/{}/id".format(num)
-                    )
+                    self.add_location(path_prefix, "/recipientOrganization/{}/id".format(num), features)
 
             if count_failure:
                 self.count += 1
         except KeyError:
             pass
 
+    def finalize(self):
         self.heading = mark_safe(
             self.format_heading_count(
                 self.check_text["heading"], test_class_type=TestType.QUALITY_TEST_CLASS
@@ -688,26 +1050,23 @@ class FundingOrgUnrecognisedPrefix(AdditionalTest):
     )
 
     category = TestCategories.ORGANISATIONS
+    required_fields = ["/grants/fundingOrganization/id"]
 
-    def process(self, grant, path_prefix):
+    def process(self, grant, path_prefix, features=None):
         try:
             count_failure = False
             for num, organization in enumerate(grant["fundingOrganization"]):
-                for prefix in orgids_prefixes:
-                    if organization["id"].lower().startswith(prefix.lower()):
-                        break
-                else:
+                if self.verdict_cache.verdict(org_id_has_unrecognised_prefix, organization["id"]):
                     self.failed = True
                     count_failure = True
-                    self.json_locations.append(
-                        path_prefix + "/fundingOrganization/{}/id".format(num)
-                    )
+                    self.add_location(path_prefix, "/fundingOrganization/{}/id".format(num), features)
 
             if count_failure:
                 self.count += 1
         except KeyError:
             pass
 
+    def finalize(self):
         self.heading = mark_safe(
             self.format_heading_count(
                 self.check_text["heading"], test_class_type=TestType.QUALITY_TEST_CLASS
@@ -740,32 +1099,25 @@ class RecipientOrgCharityNumber(AdditionalTest):
     )
 
     category = TestCategories.ORGANISATIONS
+    relevant_grant_type = TestRelevance.RECIPIENT_ORGANISATION
+    required_fields = ["/grants/recipientOrganization/charityNumber"]
 
-    def __init__(self, **kwargs):
-        super().__init__(**kwargs)
-        self.relevant_grant_type = TestRelevance.RECIPIENT_ORGANISATION
-
-    def process(self, grant, path_prefix):
+    def process(self, grant, path_prefix, features=None):
         try:
             count_failure = False
             for num, organization in enumerate(grant["recipientOrganization"]):
-                charity_number = organization["charityNumber"]
-                charity_number = str(charity_number)
-                if charity_number[:2].isalpha():
-                    charity_number = charity_number[2:]
-                if not check_charity_number(charity_number):
+                charity_number = str(organization["charityNumber"])
+                if self.verdict_cache.verdict(charity_number_looks_invalid, charity_number):
                     self.failed = True
                     count_failure = True
-                    self.json_locations.append(
-                        path_prefix
-                        + "/recipientOrganization/{}/charityNumber".format(num)
-                    )
+                    self.add_location(path_prefix, "/recipientOrganization/{}/charityNumber".format(num), features)
 
             if count_failure:
                 self.count += 1
         except KeyError:
             pass
 
+    def finalize(self):
         self.heading = mark_safe(
             self.format_heading_count(
                 self.check_text["heading"], test_class_type=TestType.QUALITY_TEST_CLASS
@@ -799,29 +1151,25 @@ class RecipientOrgCompanyNumber(AdditionalTest):
     )
 
     category = TestCategories.ORGANISATIONS
+    relevant_grant_type = TestRelevance.RECIPIENT_ORGANISATION
+    required_fields = ["/grants/recipientOrganization/companyNumber"]
 
-    def __init__(self, **kwargs):
-        super().__init__(**kwargs)
-        self.relevant_grant_type = TestRelevance.RECIPIENT_ORGANISATION
-
-    def process(self, grant, path_prefix):
+    def process(self, grant, path_prefix, features=None):
         try:
             count_failure = False
             for num, organization in enumerate(grant["recipientOrganization"]):
                 company_number = organization["companyNumber"]
-                if not check_company_number(company_number):
+                if self.verdict_cache.verdict(company_number_looks_invalid, company_number):
                     self.failed = True
                     count_failure = True
-                    self.json_locations.append(
-                        path_prefix
-                        + "/recipientOrganization/{}/companyNumber".format(num)
-                    )
+                    self.add_location(path_prefix, "/recipientOrganization/{}/companyNumber".format(num), features)
 
             if count_failure:
                 self.count += 1
         except KeyError:
             pass
 
+    def finalize(self):
         self.heading = mark_safe(
             self.format_heading_count(
                 self.check_text["heading"], test_class_type=TestType.QUALITY_TEST_CLASS
@@ -850,12 +1198,10 @@ class NoRecipientOrgCompanyCharityNumber(AdditionalTest):
     )
 
     category = TestCategories.ORGANISATIONS
+    relevant_grant_type = TestRelevance.RECIPIENT_ORGANISATION
+    required_fields = ["/grants/recipientOrganization"]
 
-    def __init__(self, **kwargs):
-        super().__init__(**kwargs)
-        self.relevant_grant_type = TestRelevance.RECIPIENT_ORGANISATION
-
-    def process(self, grant, path_prefix):
+    def process(self, grant, path_prefix, features=None):
         try:
             count_failure = False
             for num, organization in enumerate(grant["recipientOrganization"]):
@@ -865,15 +1211,14 @@ class NoRecipientOrgCompanyCharityNumber(AdditionalTest):
                 if not has_id_number:
                     self.failed = True
                     count_failure = True
-                    self.json_locations.append(
-                        path_prefix + "/recipientOrganization/{}/id".format(num)
-                    )
+                    self.add_location(path_prefix, "/recipientOrganization/{}/id".format(num), features)
 
             if count_failure:
                 self.count += 1
         except KeyError:
             pass
 
+    def finalize(self):
         self.heading = mark_safe(
             self.format_heading_count(self.check_text["heading"], verb="do")
         )
@@ -902,12 +1247,10 @@ class IncompleteRecipientOrg(AdditionalTest):
     )
 
     category = TestCategories.LOCATION
+    relevant_grant_type = TestRelevance.RECIPIENT_ORGANISATION
+    required_fields = ["/grants/recipientOrganization"]
 
-    def __init__(self, **kwargs):
-        super().__init__(**kwargs)
-        self.relevant_grant_type = TestRelevance.RECIPIENT_ORGANISATION
-
-    def process(self, grant, path_prefix):
+    def process(self, grant, path_prefix, features=None):
         try:
             count_failure = False
             for num, organization in enumerate(grant["recipientOrganization"]):
@@ -921,14 +1264,13 @@ class IncompleteRecipientOrg(AdditionalTest):
                 if not complete_recipient_org_data:
                     self.failed = True
                     count_failure = True
-                    self.json_locations.append(
-                        path_prefix + "/recipientOrganization/{}/id".format(num)
-                    )
+                    self.add_location(path_prefix, "/recipientOrganization/{}/id".format(num), features)
             if count_failure:
                 self.count += 1
         except KeyError:
             pass
 
+    def finalize(self):
         self.heading = self.format_heading_count(self.check_text["heading"], verb="do")
         self.message = mark_safe(self.check_text["message"][self.grants_percentage])
 
@@ -950,12 +1292,15 @@ class MoreThanOneFundingOrg(AdditionalTest):
 
     category = TestCategories.ORGANISATIONS
     importance = TestImportance.CRITICAL
+    required_fields = ["/grants/fundingOrganization/id"]
 
     def __init__(self, **kw):
         super().__init__(**kw)
         self.funding_organization_ids = []
+        # The location of the first use of each id, json_locations may not keep all of them
+        self.funding_organization_locations = []
 
-    def process(self, grant, path_prefix):
+    def process(self, grant, path_prefix, features=None):
         try:
             for num, organization in enumerate(grant["fundingOrganization"]):
                 if (
@@ -963,14 +1308,24 @@ class MoreThanOneFundingOrg(AdditionalTest):
                     and organization.get("id") not in self.funding_organization_ids
                 ):
                     self.funding_organization_ids.append(organization["id"])
-                    self.json_locations.append(
-                        path_prefix + "/fundingOrganization/{}/id".format(num)
-                    )
+                    location = path_prefix + "/fundingOrganization/{}/id".format(num)
+                    self.funding_organization_locations.append(location)
+                    self.json_locations.append(location)
         except KeyError:
             pass
         if len(self.funding_organization_ids) > 1:
             self.failed = True
 
+    def merge(self, other):
+        for org_id, location in zip(other.funding_organization_ids, other.funding_organization_locations):
+            if org_id not in self.funding_organization_ids:
+                self.funding_organization_ids.append(org_id)
+                self.funding_organization_locations.append(location)
+                self.json_locations.append(location)
+        if len(self.funding_organization_ids) > 1:
+            self.failed = True
+
+    def finalize(self):
         self.heading = self.check_text["heading"].format(
             len(self.funding_organization_ids)
         )
@@ -980,6 +1335,40 @@ class MoreThanOneFundingOrg(AdditionalTest):
 compiled_email_re = re.compile(r"[\w.-]+@[\w.-]+\.[\w.-]+")
 
 
+def looks_like_email(value):
+    return isinstance(value, str) and "@" in value and compiled_email_re.search(value) is not None
+
+
+def email_paths(grant):
+    """The paths (as in flatten_dict) of the strings in grant that look like an email address
+
+    Skips anything under a key containing "email". The path is only made for strings
+    that match, in the same order as flatten_dict would give them.
+    """
+    matches = []
+    # (path as a tuple of keys and list indexes, dict)
+    stack = [((), grant)]
+    while stack:
+        path, obj = stack.pop()
+        for key, value in obj.items():
+            if "email" in key:
+                continue
+            if isinstance(value, list):
+                for num, item in enumerate(value):
+                    if isinstance(item, dict):
+                        stack.append((path + (key, num), item))
+                    elif looks_like_email(item):
+                        matches.append(path + (key, num))
+            elif isinstance(value, dict):
+                stack.append((path + (key,), value))
+            elif looks_like_email(value):
+                matches.append(path + (key,))
+
+    # flatten_dict goes through the keys in sorted order
+    matches.sort()
+    return ["".join("/{}".format(part) for part in match) for match in matches]
+
+
 class LooksLikeEmail(AdditionalTest):
     """Checks if any grants contain text that looks like an email address
 
@@ -1004,16 +1393,13 @@ class LooksLikeEmail(AdditionalTest):
     category = TestCategories.DATA_PROTECTION
     importance = TestImportance.CRITICAL
 
-    def process(self, grant, path_prefix):
-        flattened_grant = OrderedDict(flatten_dict(grant))
-        for key, value in flattened_grant.items():
-            if "email" in key:
-                continue
-            if isinstance(value, str) and compiled_email_re.search(value):
-                self.failed = True
-                self.json_locations.append(path_prefix + key)
-                self.count += 1
+    def process(self, grant, path_prefix, features=None):
+        for path in email_paths(grant):
+            self.failed = True
+            self.add_location(path_prefix, path, features)
+            self.count += 1
 
+    def finalize(self):
         self.heading = self.format_heading_count(
             self.check_text["heading"],
             test_class_type=TestType.QUALITY_TEST_CLASS,
@@ -1041,13 +1427,14 @@ class NoGrantProgramme(AdditionalTest):
 
     category = TestCategories.GRANTS
 
-    def process(self, grant, path_prefix):
+    def process(self, grant, path_prefix, features=None):
         grant_programme = grant.get("grantProgramme")
         if not grant_programme:
             self.failed = True
             self.count += 1
-            self.json_locations.append(path_prefix + "/id")
+            self.add_location(path_prefix, "/id", features)
 
+    def finalize(self):
         self.heading = mark_safe(
             self.format_heading_count(self.check_text["heading"], verb="do")
         )
@@ -1074,13 +1461,14 @@ class NoBeneficiaryLocation(AdditionalTest):
 
     category = TestCategories.LOCATION
 
-    def process(self, grant, path_prefix):
+    def process(self, grant, path_prefix, features=None):
         beneficiary_location = grant.get("beneficiaryLocation")
         if not beneficiary_location:
             self.failed = True
             self.count += 1
-            self.json_locations.append(path_prefix + "/id")
+            self.add_location(path_prefix, "/id", features)
 
+    def finalize(self):
         self.heading = self.format_heading_count(self.check_text["heading"], verb="do")
         self.message = self.check_text["message"][self.grants_percentage]
 
@@ -1099,14 +1487,15 @@ class TitleDescriptionSame(AdditionalTest):
 
     category = TestCategories.GRANTS
 
-    def process(self, grant, path_prefix):
+    def process(self, grant, path_prefix, features=None):
         title = grant.get("title")
         description = grant.get("description")
         if title and description and title == description:
             self.failed = True
             self.count += 1
-            self.json_locations.append(path_prefix + "/description")
+            self.add_location(path_prefix, "/description", features)
 
+    def finalize(self):
         self.heading = self.format_heading_count(self.check_text["heading"])
         self.message = self.check_text["message"][self.grants_percentage]
 
@@ -1125,13 +1514,14 @@ class TitleLength(AdditionalTest):
 
     category = TestCategories.GRANTS
 
-    def process(self, grant, path_prefix):
+    def process(self, grant, path_prefix, features=None):
         title = grant.get("title", "")
         if len(title) > 140:
             self.failed = True
             self.count += 1
-            self.json_locations.append(path_prefix + "/title")
+            self.add_location(path_prefix, "/title", features)
 
+    def finalize(self):
         self.heading = self.format_heading_count(self.check_text["heading"])
         self.message = self.check_text["message"][self.grants_percentage]
 
@@ -1154,17 +1544,15 @@ class GrantIdUnexpectedChars(AdditionalTest):
 
     category = TestCategories.GRANTS
     importance = TestImportance.CRITICAL
+    relevant_grant_type = TestRelevance.RECIPIENT_ANY
 
-    def __init__(self, **kwargs):
-        super().__init__(**kwargs)
-        self.relevant_grant_type = TestRelevance.RECIPIENT_ANY
-
-    def process(self, grant, path_prefix):
+    def process(self, grant, path_prefix, features=None):
         if "\n" in grant.get("id"):
             self.failed = True
-            self.json_locations.append(path_prefix + "/id")
+            self.add_location(path_prefix, "/id", features)
             self.count += 1
 
+    def finalize(self):
         self.heading = self.format_heading_count(
             self.check_text["heading"], test_class_type=TestType.QUALITY_TEST_CLASS
         )
@@ -1189,25 +1577,24 @@ class OrganizationIdUnexpectedChars(AdditionalTest):
 
     category = TestCategories.ORGANISATIONS
     importance = TestImportance.CRITICAL
+    relevant_grant_type = TestRelevance.RECIPIENT_ORGANISATION
+    required_fields = ["/grants/fundingOrganization/id", "/grants/recipientOrganization/id"]
+
+    def process(self, grant, path_prefix, features=None):
+        features = features or GrantFeatures(grant)
+        for org_type, org_ids in (
+            ("fundingOrganization", features.funding_org_ids),
+            ("recipientOrganization", features.recipient_org_ids),
+        ):
+            for num, org_id in org_ids:
+                id_location = "/{}/{}/id".format(org_type, num)
 
-    def __init__(self, **kwargs):
-        super().__init__(**kwargs)
-        self.relevant_grant_type = TestRelevance.RECIPIENT_ORGANISATION
-
-    def process(self, grant, path_prefix):
-        for org_type in ("fundingOrganization", "recipientOrganization"):
-            orgs = grant.get(org_type, [])
-            for num, org in enumerate(orgs):
-                org_id = org.get("id")
-                if not org_id:
-                    continue
-                id_location = "{}/{}/{}/id".format(path_prefix, org_type, num)
-
-                if "\n" in org_id:
+                if self.verdict_cache.verdict(org_id_has_unexpected_chars, org_id):
                     self.failed = True
-                    self.json_locations.append(id_location)
+                    self.add_location(path_prefix, id_location, features)
                     self.count += 1
 
+    def finalize(self):
         self.heading = self.format_heading_count(
             self.check_text["heading"], test_class_type=TestType.QUALITY_TEST_CLASS
         )
@@ -1236,31 +1623,24 @@ class OrganizationIdLooksInvalid(AdditionalTest):
     )
 
     category = TestCategories.ORGANISATIONS
+    relevant_grant_type = TestRelevance.RECIPIENT_ORGANISATION
+    required_fields = ["/grants/fundingOrganization/id", "/grants/recipientOrganization/id"]
+
+    def process(self, grant, path_prefix, features=None):
+        features = features or GrantFeatures(grant)
+        for org_type, org_ids in (
+            ("fundingOrganization", features.funding_org_ids),
+            ("recipientOrganization", features.recipient_org_ids),
+        ):
+            for num, org_id in org_ids:
+                id_location = "/{}/{}/id".format(org_type, num)
 
-    def __init__(self, **kwargs):
-        super().__init__(**kwargs)
-        self.relevant_grant_type = TestRelevance.RECIPIENT_ORGANISATION
-
-    def process(self, grant, path_prefix):
-        for org_type in ("fundingOrganization", "recipientOrganization"):
-            orgs = grant.get(org_type, [])
-            for num, org in enumerate(orgs):
-                org_id = org.get("id")
-                if not org_id:
-                    continue
-                id_location = "{}/{}/{}/id".format(path_prefix, org_type, num)
-
-                if org_id.upper().startswith("GB-CHC-"):
-                    if not check_charity_number(org_id[7:]):
-                        self.failed = True
-                        self.json_locations.append(id_location)
-                        self.count += 1
-                elif org_id.upper().startswith("GB-COH-"):
-                    if not check_company_number(org_id[7:]):
-                        self.failed = True
-                        self.json_locations.append(id_location)
-                        self.count += 1
+                if self.verdict_cache.verdict(org_id_looks_invalid, org_id):
+                    self.failed = True
+                    self.add_location(path_prefix, id_location, features)
+                    self.count += 1
 
+    def finalize(self):
         self.heading = self.format_heading_count(
             self.check_text["heading"], test_class_type=TestType.QUALITY_TEST_CLASS
         )
@@ -1284,13 +1664,14 @@ class NoLastModified(AdditionalTest):
 
     category = TestCategories.METADATA
 
-    def process(self, grant, path_prefix):
+    def process(self, grant, path_prefix, features=None):
         last_modified = grant.get("dateModified")
         if not last_modified:
             self.failed = True
             self.count += 1
-            self.json_locations.append(path_prefix + "/id")
+            self.add_location(path_prefix, "/id", features)
 
+    def finalize(self):
         self.heading = mark_safe(
             self.format_heading_count(self.check_text["heading"], verb="do")
         )
@@ -1317,13 +1698,14 @@ class NoDataSource(AdditionalTest):
 
     category = TestCategories.METADATA
 
-    def process(self, grant, path_prefix):
+    def process(self, grant, path_prefix, features=None):
         data_source = grant.get("dataSource")
         if not data_source:
             self.failed = True
             self.count += 1
-            self.json_locations.append(path_prefix + "/id")
+            self.add_location(path_prefix, "/id", features)
 
+    def finalize(self):
         self.heading = mark_safe(
             self.format_heading_count(self.check_text["heading"], verb="do")
         )
@@ -1347,44 +1729,33 @@ class ImpossibleDates(AdditionalTest):
 
     category = TestCategories.DATES
     importance = TestImportance.CRITICAL
+    required_fields = [
+        "/grants/awardDate",
+        "/grants/plannedDates/startDate",
+        "/grants/plannedDates/endDate",
+        "/grants/actualDates/startDate",
+        "/grants/actualDates/endDate",
+    ]
 
-    def process(self, grant, path_prefix):
-        grant_dates = create_grant_dates_dict(Grant(grant))
+    def process(self, grant, path_prefix, features=None):
+        features = features or GrantFeatures(grant)
+        grant_dates = features.dates
 
         if grant_dates:
-            for date_type, date_format_error in (
-                [
-                    "award_date",
-                    grant_dates.get("award_date", {}).get("date_format_error"),
-                ],
-                [
-                    "planned_start_date",
-                    grant_dates.get("planned_start_date", {}).get("date_format_error"),
-                ],
-                [
-                    "planned_end_date",
-                    grant_dates.get("planned_end_date", {}).get("date_format_error"),
-                ],
-                [
-                    "actual_start_date",
-                    grant_dates.get("actual_start_date", {}).get("date_format_error"),
-                ],
-                [
-                    "actual_end_date",
-                    grant_dates.get("actual_end_date", {}).get("date_format_error"),
-                ],
-            ):
-                if date_format_error:
-                    if (
-                        "does not match format '%Y-%m-%d'" not in date_format_error
-                    ) and ("unconverted data remains" not in date_format_error):
-                        self.failed = True
-                        self.count += 1
-                        self.json_locations.append(
-                            path_prefix + DATES_JSON_LOCATION[date_type]
-                        )
-                        break
+            for date_type in DATES_JSON_LOCATION:
+                if grant_dates.get(date_type, {}).get("date_error") == DateError.OUT_OF_RANGE:
+                    self.failed = True
+                    self.count += 1
+                    self.add_location(path_prefix, DATES_JSON_LOCATION[date_type], features)
+                    break
+
+    def process_columns(self, columns):
+        add_column_failures(self, columns, [
+            (DATES_JSON_LOCATION[date_type], columns.impossible_dates[date_type])
+            for date_type in DATES_JSON_LOCATION
+        ])
 
+    def finalize(self):
         self.heading = self.format_heading_count(self.check_text["heading"])
         self.message = self.check_text["message"][self.grants_percentage]
 
@@ -1405,9 +1776,11 @@ class PlannedStartDateBeforeEndDate(AdditionalTest):
     )
 
     category = TestCategories.DATES
+    required_fields = ["/grants/plannedDates/startDate", "/grants/plannedDates/endDate"]
 
-    def process(self, grant, path_prefix):
-        grant_dates = create_grant_dates_dict(Grant(grant))
+    def process(self, grant, path_prefix, features=None):
+        features = features or GrantFeatures(grant)
+        grant_dates = features.dates
 
         if grant_dates:
             planned_start_date = grant_dates.get("planned_start_date", {}).get(
@@ -1421,10 +1794,15 @@ class PlannedStartDateBeforeEndDate(AdditionalTest):
                 if planned_start_date > planned_end_date:
                     self.failed = True
                     self.count += 1
-                    self.json_locations.append(
-                        path_prefix + DATES_JSON_LOCATION["planned_start_date"]
-                    )
+                    self.add_location(path_prefix, DATES_JSON_LOCATION["planned_start_date"], features)
 
+    def process_columns(self, columns):
+        add_column_failures(self, columns, [(
+            DATES_JSON_LOCATION["planned_start_date"],
+            columns.dates["planned_start_date"] > columns.dates["planned_end_date"],
+        )])
+
+    def finalize(self):
         self.heading = mark_safe(self.format_heading_count(self.check_text["heading"]))
         self.message = self.check_text["message"][self.grants_percentage]
 
@@ -1445,9 +1823,11 @@ class ActualStartDateBeforeEndDate(AdditionalTest):
     )
 
     category = TestCategories.DATES
+    required_fields = ["/grants/actualDates/startDate", "/grants/actualDates/endDate"]
 
-    def process(self, grant, path_prefix):
-        grant_dates = create_grant_dates_dict(Grant(grant))
+    def process(self, grant, path_prefix, features=None):
+        features = features or GrantFeatures(grant)
+        grant_dates = features.dates
 
         if grant_dates:
             actual_start_date = grant_dates.get("actual_start_date", {}).get(
@@ -1461,10 +1841,15 @@ class ActualStartDateBeforeEndDate(AdditionalTest):
                 if actual_start_date > actual_end_date:
                     self.failed = True
                     self.count += 1
-                    self.json_locations.append(
-                        path_prefix + DATES_JSON_LOCATION["actual_start_date"]
-                    )
+                    self.add_location(path_prefix, DATES_JSON_LOCATION["actual_start_date"], features)
+
+    def process_columns(self, columns):
+        add_column_failures(self, columns, [(
+            DATES_JSON_LOCATION["actual_start_date"],
+            columns.dates["actual_start_date"] > columns.dates["actual_end_date"],
+        )])
 
+    def finalize(self):
         self.heading = mark_safe(self.format_heading_count(self.check_text["heading"]))
         self.message = self.check_text["message"][self.grants_percentage]
 
@@ -1483,9 +1868,12 @@ class FarFuturePlannedDates(AdditionalTest):
     )
 
     category = TestCategories.DATES
+    required_fields = ["/grants/plannedDates/startDate", "/grants/plannedDates/endDate"]
 
-    def process(self, grant, path_prefix):
-        grant_dates = create_grant_dates_dict(Grant(grant))
+    def process(self, grant, path_prefix, features=None):
+        features = features or GrantFeatures(grant)
+        grant_dates = features.dates
+        cutoff = self.reference_time.years_from_now(12)
 
         if grant_dates:
             for date_type, input_date in (
@@ -1499,14 +1887,20 @@ class FarFuturePlannedDates(AdditionalTest):
                 ],
             ):
                 if input_date:
-                    if input_date > datetime.datetime.now() + relativedelta(years=12):
+                    if input_date > cutoff:
                         self.failed = True
                         self.count += 1
-                        self.json_locations.append(
-                            path_prefix + DATES_JSON_LOCATION[date_type]
-                        )
+                        self.add_location(path_prefix, DATES_JSON_LOCATION[date_type], features)
                         break
 
+    def process_columns(self, columns):
+        cutoff = numpy.datetime64(self.reference_time.years_from_now(12), "us")
+        add_column_failures(self, columns, [
+            (DATES_JSON_LOCATION[date_type], columns.dates[date_type] > cutoff)
+            for date_type in ("planned_start_date", "planned_end_date")
+        ])
+
+    def finalize(self):
         self.heading = self.format_heading_count(self.check_text["heading"])
         self.message = self.check_text["message"][self.grants_percentage]
 
@@ -1525,9 +1919,12 @@ class FarFutureActualDates(AdditionalTest):
     )
 
     category = TestCategories.DATES
+    required_fields = ["/grants/actualDates/startDate", "/grants/actualDates/endDate"]
 
-    def process(self, grant, path_prefix):
-        grant_dates = create_grant_dates_dict(Grant(grant))
+    def process(self, grant, path_prefix, features=None):
+        features = features or GrantFeatures(grant)
+        grant_dates = features.dates
+        cutoff = self.reference_time.years_from_now(5)
 
         if grant_dates:
             for date_type, input_date in (
@@ -1541,14 +1938,20 @@ class FarFutureActualDates(AdditionalTest):
                 ],
             ):
                 if input_date:
-                    if input_date > datetime.datetime.now() + relativedelta(years=5):
+                    if input_date > cutoff:
                         self.failed = True
                         self.count += 1
-                        self.json_locations.append(
-                            path_prefix + DATES_JSON_LOCATION[date_type]
-                        )
+                        self.add_location(path_prefix, DATES_JSON_LOCATION[date_type], features)
                         break
 
+    def process_columns(self, columns):
+        cutoff = numpy.datetime64(self.reference_time.years_from_now(5), "us")
+        add_column_failures(self, columns, [
+            (DATES_JSON_LOCATION[date_type], columns.dates[date_type] > cutoff)
+            for date_type in ("actual_start_date", "actual_end_date")
+        ])
+
+    def finalize(self):
         self.heading = self.format_heading_count(self.check_text["heading"])
         self.message = self.check_text["message"][self.grants_percentage]
 
@@ -1566,9 +1969,18 @@ class FarPastDates(AdditionalTest):
     )
 
     category = TestCategories.DATES
+    required_fields = [
+        "/grants/awardDate",
+        "/grants/plannedDates/startDate",
+        "/grants/plannedDates/endDate",
+        "/grants/actualDates/startDate",
+        "/grants/actualDates/endDate",
+    ]
 
-    def process(self, grant, path_prefix):
-        grant_dates = create_grant_dates_dict(Grant(grant))
+    def process(self, grant, path_prefix, features=None):
+        features = features or GrantFeatures(grant)
+        grant_dates = features.dates
+        cutoff = self.reference_time.years_from_now(-25)
 
         if grant_dates:
             for date_type, input_date in (
@@ -1592,14 +2004,20 @@ class FarPastDates(AdditionalTest):
             ):
 
                 if input_date:
-                    if input_date < datetime.datetime.now() - relativedelta(years=25):
+                    if input_date < cutoff:
                         self.failed = True
                         self.count += 1
-                        self.json_locations.append(
-                            path_prefix + DATES_JSON_LOCATION[date_type]
-                        )
+                        self.add_location(path_prefix, DATES_JSON_LOCATION[date_type], features)
                         break
 
+    def process_columns(self, columns):
+        cutoff = numpy.datetime64(self.reference_time.years_from_now(-25), "us")
+        add_column_failures(self, columns, [
+            (DATES_JSON_LOCATION[date_type], columns.dates[date_type] < cutoff)
+            for date_type in DATES_JSON_LOCATION
+        ])
+
+    def finalize(self):
         self.heading = self.format_heading_count(self.check_text["heading"])
         self.message = self.check_text["message"][self.grants_percentage]
 
@@ -1619,20 +2037,27 @@ class PostDatedAwardDates(AdditionalTest):
 
     category = TestCategories.DATES
     importance = TestImportance.CRITICAL
+    required_fields = ["/grants/awardDate"]
 
-    def process(self, grant, path_prefix):
-        grant_dates = create_grant_dates_dict(Grant(grant))
+    def process(self, grant, path_prefix, features=None):
+        features = features or GrantFeatures(grant)
+        grant_dates = features.dates
 
         if grant_dates:
             award_date = grant_dates.get("award_date", {}).get("datetime_date")
             if award_date:
-                if award_date > datetime.datetime.now():
+                if award_date > self.reference_time.now:
                     self.failed = True
                     self.count += 1
-                    self.json_locations.append(
-                        path_prefix + DATES_JSON_LOCATION["award_date"]
-                    )
+                    self.add_location(path_prefix, DATES_JSON_LOCATION["award_date"], features)
+
+    def process_columns(self, columns):
+        now = numpy.datetime64(self.reference_time.now, "us")
+        add_column_failures(self, columns, [
+            (DATES_JSON_LOCATION["award_date"], columns.dates["award_date"] > now)
+        ])
 
+    def finalize(self):
         self.heading = self.format_heading_count(self.check_text["heading"])
         self.message = self.check_text["message"][self.grants_percentage]
 
@@ -1658,19 +2083,17 @@ class RecipientIndWithoutToIndividualsDetails(AdditionalTest):
     )
 
     category = TestCategories.GRANTS
+    relevant_grant_type = TestRelevance.RECIPIENT_INDIVIDUAL
+    required_fields = ["/grants/recipientIndividual"]
 
-    def __init__(self, **kwargs):
-        super().__init__(**kwargs)
-        self.relevant_grant_type = TestRelevance.RECIPIENT_INDIVIDUAL
-
-    def process(self, grant, path_prefix):
-        if "recipientIndividual" in grant and "toIndividualsDetails" not in grant:
+    def process(self, grant, path_prefix, features=None):
+        features = features or GrantFeatures(grant)
+        if features.has_recipient_individual and "toIndividualsDetails" not in grant:
             self.failed = True
             self.count += 1
-            self.json_locations.append(
-                path_prefix + "/recipientIndividual/id"
-            )
+            self.add_location(path_prefix, "/recipientIndividual/id", features)
 
+    def finalize(self):
         self.heading = mark_safe(self.format_heading_count(self.check_text["heading"]))
         self.message = self.check_text["message"][self.grants_percentage]
 
@@ -1691,19 +2114,17 @@ class RecipientIndDEI(AdditionalTest):
 
     category = TestCategories.DATA_PROTECTION
     importance = TestImportance.CRITICAL
+    relevant_grant_type = TestRelevance.RECIPIENT_INDIVIDUAL
+    required_fields = ["/grants/recipientIndividual"]
 
-    def __init__(self, **kwargs):
-        super().__init__(**kwargs)
-        self.relevant_grant_type = TestRelevance.RECIPIENT_INDIVIDUAL
-
-    def process(self, grant, path_prefix):
-        if "recipientIndividual" in grant and "project" in grant:
+    def process(self, grant, path_prefix, features=None):
+        features = features or GrantFeatures(grant)
+        if features.has_recipient_individual and "project" in grant:
             self.failed = True
             self.count += 1
-            self.json_locations.append(
-                path_prefix + "/recipientIndividual/id"
-            )
+            self.add_location(path_prefix, "/recipientIndividual/id", features)
 
+    def finalize(self):
         self.heading = mark_safe(self.format_heading_count(self.check_text["heading"]))
         self.message = self.check_text["message"][self.grants_percentage]
 
@@ -1736,26 +2157,53 @@ class GeoCodePostcode(AdditionalTest):
 
     category = TestCategories.DATA_PROTECTION
     importance = TestImportance.CRITICAL
+    relevant_grant_type = TestRelevance.RECIPIENT_INDIVIDUAL
+    required_fields = ["/grants/recipientIndividual"]
 
-    def __init__(self, **kwargs):
-        super().__init__(**kwargs)
-        self.relevant_grant_type = TestRelevance.RECIPIENT_INDIVIDUAL
-
-    def process(self, grant, path_prefix):
-        if "recipientIndividual" in grant:
+    def process(self, grant, path_prefix, features=None):
+        features = features or GrantFeatures(grant)
+        if features.has_recipient_individual:
             for num, beneficiary_location in enumerate(grant.get("beneficiaryLocation", [])):
                 geo_code = beneficiary_location.get("geoCode", "")
                 if postcode_re.match(geo_code):
                     self.failed = True
                     self.count += 1
-                    self.json_locations.append(
-                        "{}/beneficiaryLocation/{}/geoCode".format(path_prefix, num)
-                    )
+                    self.add_location(path_prefix, "/beneficiaryLocation/{}/geoCode".format(num), features)
 
+    def finalize(self):
         self.heading = self.format_heading_count(self.check_text["heading"])
         self.message = self.check_text["message"][self.grants_percentage]
 
 
+def json_location_sort_key(location):
+    """Sort key to put json locations like grants/10/fundingOrganization/0/id in file order"""
+    return tuple(int(part) for part in location.split("/") if part.isdigit())
+
+
+def merge_first_seen_values(test_instance, other, first_seen, other_first_seen):
+    """merge() for checks that flag any value that differs from the first value seen for a key
+
+    first_seen/other_first_seen are dicts of key to the first value seen for it.
+    other must have been run with keep_merge_state so that it recorded the
+    (key, value, location) of each failure and the locations where its first value was seen,
+    as a value only fails against the first value seen across all of the grants.
+    """
+    new_locations = []
+    for key, value, location in other.failed_values:
+        if first_seen.get(key, other_first_seen[key]) != value:
+            new_locations.append(location)
+    for key, locations in other.first_seen_locations.items():
+        if key in first_seen and first_seen[key] != other_first_seen[key]:
+            new_locations.extend(locations)
+    for key, value in other_first_seen.items():
+        first_seen.setdefault(key, value)
+
+    new_locations.sort(key=json_location_sort_key)
+    test_instance.json_locations.extend(new_locations)
+    test_instance.count += len(new_locations)
+    test_instance.failed = test_instance.failed or bool(new_locations)
+
+
 class MultiFundingOrgIdsForName(AdditionalTest):
     """Check for multiple org ids with same funding organisation name."""
 
@@ -1770,13 +2218,17 @@ class MultiFundingOrgIdsForName(AdditionalTest):
     )
 
     category = TestCategories.ORGANISATIONS
+    required_fields = ["/grants/fundingOrganization"]
 
     def __init__(self, **kw):
         super().__init__(**kw)
         #  zxy-name: { names: [] }
         self.funding_organisation_names = {}
+        # Only kept for merge()
+        self.failed_values = []
+        self.first_seen_locations = defaultdict(list)
 
-    def process(self, grant, path_prefix):
+    def process(self, grant, path_prefix, features=None):
         # Some test data doesn't have the full valid grant
         if "fundingOrganization" not in grant:
             return
@@ -1792,14 +2244,21 @@ class MultiFundingOrgIdsForName(AdditionalTest):
                 self.funding_organisation_names[name] = org_id
                 found_org_id = org_id
 
+            suffix = "/fundingOrganization/{}/id".format(num)
             if found_org_id != org_id:
                 # We have a brand new org id for this funder name, suspicious.
-                self.json_locations.append(
-                    path_prefix + "/fundingOrganization/{}/id".format(num)
-                )
+                self.add_location(path_prefix, suffix, features)
                 self.count = self.count + 1
                 self.failed = True
+                if self.keep_merge_state:
+                    self.failed_values.append((name, org_id, path_prefix + suffix))
+            elif self.keep_merge_state:
+                self.first_seen_locations[name].append(path_prefix + suffix)
 
+    def merge(self, other):
+        merge_first_seen_values(self, other, self.funding_organisation_names, other.funding_organisation_names)
+
+    def finalize(self):
         self.heading = self.format_heading_count(self.check_text["heading"])
         self.message = mark_safe(self.check_text["message"][self.grants_percentage])
 
@@ -1818,13 +2277,17 @@ class MultiFundingNamesForOrgId(AdditionalTest):
     )
 
     category = TestCategories.ORGANISATIONS
+    required_fields = ["/grants/fundingOrganization"]
 
     def __init__(self, **kw):
         super().__init__(**kw)
         #  zxy-name: { names: [] }
         self.funding_organisation_ids = {}
+        # Only kept for merge()
+        self.failed_values = []
+        self.first_seen_locations = defaultdict(list)
 
-    def process(self, grant, path_prefix):
+    def process(self, grant, path_prefix, features=None):
         # Some test data doesn't have the full valid grant
         if "fundingOrganization" not in grant:
             return
@@ -1840,14 +2303,21 @@ class MultiFundingNamesForOrgId(AdditionalTest):
                 self.funding_organisation_ids[org_id] = name
                 existing_name = name
 
+            suffix = "/fundingOrganization/{}/name".format(num)
             if existing_name != name:
                 # We have a brand new name for this org id, suspicious.
-                self.json_locations.append(
-                    path_prefix + "/fundingOrganization/{}/name".format(num)
-                )
+                self.add_location(path_prefix, suffix, features)
                 self.count = self.count + 1
                 self.failed = True
+                if self.keep_merge_state:
+                    self.failed_values.append((org_id, name, path_prefix + suffix))
+            elif self.keep_merge_state:
+                self.first_seen_locations[org_id].append(path_prefix + suffix)
+
+    def merge(self, other):
+        merge_first_seen_values(self, other, self.funding_organisation_ids, other.funding_organisation_ids)
 
+    def finalize(self):
         self.heading = self.format_heading_count(self.check_text["heading"])
         self.message = mark_safe(self.check_text["message"][self.grants_percentage])
 
@@ -1870,12 +2340,10 @@ class BeneficiaryButNotRecipientGeoData(AdditionalTest):
     )
 
     category = TestCategories.LOCATION
+    relevant_grant_type = TestRelevance.RECIPIENT_ORGANISATION
+    required_fields = ["/grants/beneficiaryLocation"]
 
-    def __init__(self, **kwargs):
-        super().__init__(**kwargs)
-        self.relevant_grant_type = TestRelevance.RECIPIENT_ORGANISATION
-
-    def process(self, grant, path_prefix):
+    def process(self, grant, path_prefix, features=None):
         if grant.get("recipientIndividual"):
             return
 
@@ -1887,10 +2355,9 @@ class BeneficiaryButNotRecipientGeoData(AdditionalTest):
         ):
             self.failed = True
             self.count += 1
-            self.json_locations.append(
-                path_prefix + "/recipientOrganization/0/id"
-            )
+            self.add_location(path_prefix, "/recipientOrganization/0/id", features)
 
+    def finalize(self):
         self.heading = mark_safe(self.format_heading_count(self.check_text["heading"]))
         self.message = self.check_text["message"][self.grants_percentage]
 
@@ -1913,12 +2380,9 @@ class RecipientGeoDataButNoBeneficiary(AdditionalTest):
     )
 
     category = TestCategories.LOCATION
+    relevant_grant_type = TestRelevance.RECIPIENT_ORGANISATION
 
-    def __init__(self, **kwargs):
-        super().__init__(**kwargs)
-        self.relevant_grant_type = TestRelevance.RECIPIENT_ORGANISATION
-
-    def process(self, grant, path_prefix):
+    def process(self, grant, path_prefix, features=None):
         beneficiary_locations = grant.get("beneficiaryLocation", [])
 
         if grant.get("recipientIndividual"):
@@ -1927,10 +2391,9 @@ class RecipientGeoDataButNoBeneficiary(AdditionalTest):
         if len(grant["recipientOrganization"][0].get("location", [])) > 0 and len(beneficiary_locations) == 0:
             self.failed = True
             self.count += 1
-            self.json_locations.append(
-                path_prefix + "/recipientOrganization/0/location"
-            )
+            self.add_location(path_prefix, "/recipientOrganization/0/location", features)
 
+    def finalize(self):
         self.heading = mark_safe(self.format_heading_count(self.check_text["heading"]))
         self.message = self.check_text["message"][self.grants_percentage]
 
@@ -1953,18 +2416,18 @@ class BeneficiaryLocationNameButNoCode(AdditionalTest):
     )
 
     category = TestCategories.LOCATION
+    required_fields = ["/grants/beneficiaryLocation/name"]
 
-    def process(self, grant, path_prefix):
+    def process(self, grant, path_prefix, features=None):
         beneficiary_locations = grant.get("beneficiaryLocation", [])
 
         for num, location in enumerate(beneficiary_locations):
             if location.get("name") and not location.get("geoCode"):
                 self.failed = True
                 self.count += 1
-                self.json_locations.append(
-                    path_prefix + "/beneficiaryLocation/{}/name".format(num)
-                )
+                self.add_location(path_prefix, "/beneficiaryLocation/{}/name".format(num), features)
 
+    def finalize(self):
         self.heading = mark_safe(self.format_heading_count(self.check_text["heading"]))
         self.message = self.check_text["message"][self.grants_percentage]
 
@@ -2016,51 +2479,73 @@ TEST_CLASSES = {
 }
 
 
+# YYYY-MM-DD[T...] with a month and day that strptime would read, so any ValueError
+# from datetime is because the date doesn't exist. Anything else is left to strptime.
+iso_date_match = re.compile(r"([0-9]{4}-(?:0[1-9]|1[0-2])-(?:0[1-9]|[12][0-9]|3[01]))(?:T|\Z)").match
+
+
+class DateError(object):
+    """The kinds of error from convert_string_date_to_datetime"""
+
+    # Not YYYY-MM-DD
+    BAD_FORMAT = "bad_format"
+    # In the right format but the date doesn't exist, e.g. 2021-02-30
+    OUT_OF_RANGE = "out_of_range"
+    # YYYY-MM-DD followed by something else (other than T...)
+    TRAILING_DATA = "trailing_data"
+
+
 def convert_string_date_to_datetime(input_date):
     """
     Date format that will be converted are:
 
     YYYY-MM-DD
     YYYY-MM-DDT...
+
+    Returns (datetime_date, error) where error is None or one of DateError. Gives the
+    same results as datetime.strptime(input_date, "%Y-%m-%d") would, but the usual
+    YYYY-MM-DD form is read directly as strptime is slow.
     """
-    error_msg = None
-    datetime_date = None
+    match = iso_date_match(input_date)
+    if match:
+        try:
+            return datetime.datetime.fromisoformat(match.group(1)), None
+        except ValueError:
+            return None, DateError.OUT_OF_RANGE
 
     if "T" in input_date:
         input_date = input_date.split("T")[0]
-        convert_string_date_to_datetime(input_date)
 
     try:
-        datetime_date = datetime.datetime.strptime(input_date, "%Y-%m-%d")
+        return datetime.datetime.strptime(input_date, "%Y-%m-%d"), None
     except ValueError as e:
         error_msg = str(e)
+    if "does not match format" in error_msg:
+        return None, DateError.BAD_FORMAT
+    if "unconverted data remains" in error_msg:
+        return None, DateError.TRAILING_DATA
+    return None, DateError.OUT_OF_RANGE
 
-    return datetime_date, error_msg
-
-
-class Grant:
-    def __init__(self, grant):
-        self.grant = grant
-
-    def __hash__(self):
-        return hash(self.grant.get("id"))
 
-
-@functools.lru_cache(maxsize=None)
 def create_grant_dates_dict(grant):
     """
     Creates the following dict:
 
-    grant_dates: { 'date_type': {'datetime_date': datetime_date, 'date_format_error': error_msg}}
+    grant_dates: { 'date_type': {'datetime_date': datetime_date, 'date_error': error}}
+
+    where error is None or one of DateError.
+
+    Not cached here: the checks get it from GrantFeatures.dates, so it's worked out once
+    per grant for each run and released with the grant's GrantFeatures.
     """
     grant_dates = {}
 
-    award_date = grant.grant.get("awardDate")
+    award_date = grant.get("awardDate")
     try:
-        planned_start_date = grant.grant.get("plannedDates", [{}])[0].get("startDate")
-        planned_end_date = grant.grant.get("plannedDates", [{}])[0].get("endDate")
-        actual_start_date = grant.grant.get("actualDates", [{}])[0].get("startDate")
-        actual_end_date = grant.grant.get("actualDates", [{}])[0].get("endDate")
+        planned_start_date = grant.get("plannedDates", [{}])[0].get("startDate")
+        planned_end_date = grant.get("plannedDates", [{}])[0].get("endDate")
+        actual_start_date = grant.get("actualDates", [{}])[0].get("startDate")
+        actual_end_date = grant.get("actualDates", [{}])[0].get("endDate")
     except IndexError:
         return {}
 
@@ -2072,27 +2557,293 @@ def create_grant_dates_dict(grant):
         ["actual_end_date", actual_end_date],
     ]:
         if input_date:
-            datetime_date, error_msg = convert_string_date_to_datetime(input_date)
+            datetime_date, error = convert_string_date_to_datetime(input_date)
 
             grant_dates[date_type] = {
                 "datetime_date": datetime_date,
-                "date_format_error": error_msg,
+                "date_error": error,
             }
 
     return grant_dates
 
 
-@tools.ignore_errors
-def run_extra_checks(json_data, cell_source_map, test_classes, aggregates):
-    if "grants" not in json_data:
-        return []
+class GrantFeatures(object):
+    """Values derived from a grant that are shared by several checks
+
+    One instance is created per grant by run_extra_checks/run_checks and passed to
+    every check's process(), so each value is worked out at most once per grant
+    rather than once per check. Values are only computed when first used.
+
+    index is the grant's position in the grants list (its path_prefix is
+    "grants/<index>"), which lets checks store failure locations compactly, see
+    AdditionalTest.add_location(). None if not known.
+    """
+
+    def __init__(self, grant, index=None):
+        self.grant = grant
+        self.index = index
+
+    @functools.cached_property
+    def path_prefix(self):
+        return "grants/{}".format(self.index)
+
+    @functools.cached_property
+    def dates(self):
+        return create_grant_dates_dict(self.grant)
+
+    @functools.cached_property
+    def funding_org_ids(self):
+        """List of (num, id) for the fundingOrganization entries that have an id"""
+        return self._org_ids("fundingOrganization")
+
+    @functools.cached_property
+    def recipient_org_ids(self):
+        """List of (num, id) for the recipientOrganization entries that have an id"""
+        return self._org_ids("recipientOrganization")
+
+    @functools.cached_property
+    def has_recipient_individual(self):
+        return "recipientIndividual" in self.grant
+
+    def _org_ids(self, org_type):
+        org_ids = []
+        for num, org in enumerate(self.grant.get(org_type, [])):
+            org_id = org.get("id")
+            if org_id:
+                org_ids.append((num, org_id))
+        return org_ids
+
+
+def amount_column_value(amount):
+    """amountAwarded as a float for GrantColumns, where only being 0 or not matters"""
+    if isinstance(amount, (int, float, Decimal)):
+        try:
+            value = float(amount)
+        except OverflowError:
+            return numpy.inf
+        # Don't let very small Decimals become 0
+        if value == 0 and amount != 0:
+            return numpy.nan
+        return value
+    return numpy.nan
+
+
+def add_column_failures(test_instance, columns, masks):
+    """Record a failure for each grant in columns where any of the masks is True
+
+    masks: list of (json location suffix, boolean array with one item per grant).
+    As with the checks that stop at a grant's first failing date, each grant only
+    fails once, at the first suffix whose mask is True.
+    """
+    # For each grant, the position in masks of the first mask that is True, plus 1
+    first_failure = numpy.zeros(len(columns.path_prefixes), dtype=numpy.int8)
+    for num, (suffix, mask) in reversed(list(enumerate(masks, 1))):
+        first_failure[mask] = num
+
+    (failing,) = first_failure.nonzero()
+    for index in failing:
+        suffix = masks[first_failure[index] - 1][0]
+        grant_index = columns.grant_indexes[index]
+        if grant_index is None:
+            test_instance.json_locations.append(columns.path_prefixes[index] + suffix)
+        else:
+            test_instance.json_locations.add(grant_index, suffix)
+    if len(failing):
+        test_instance.failed = True
+        test_instance.count += len(failing)
+
+
+class GrantColumns(object):
+    """Runs the checks that define process_columns() on chunks of grants at a time
+
+    Rather than each check looking at one grant at a time, the values these checks use
+    (amountAwarded and the dates) are gathered into numpy arrays for up to chunk_size
+    grants, then each check works out which grants fail with array comparisons.
+    process_columns() must record exactly the same failures, in the same order, as
+    process() would.
+
+    Called for each grant like the other grant processors; flush() must be called
+    after the last grant.
+    """
+
+    chunk_size = 10000
+
+    def __init__(self, test_instances, timings=None):
+        self.test_instances = test_instances
+        self.timings = timings
+        if timings is not None:
+            self.add_grant = timings.timed_stage("grant_columns", self.add_grant)
+        self.clear()
+
+    def clear(self):
+        self.path_prefixes = []
+        self.grant_indexes = []
+        self.amounts = []
+        self.dates = {date_type: [] for date_type in DATES_JSON_LOCATION}
+        self.impossible_dates = {date_type: [] for date_type in DATES_JSON_LOCATION}
+
+    def __call__(self, grant, path_prefix, features=None):
+        self.add_grant(grant, path_prefix, features)
+
+    def add_grant(self, grant, path_prefix, features):
+        features = features or GrantFeatures(grant)
+        try:
+            amount = amount_column_value(grant["amountAwarded"])
+        except KeyError:
+            amount = numpy.nan
+        grant_dates = features.dates
+
+        self.path_prefixes.append(path_prefix)
+        self.grant_indexes.append(features.index)
+        self.amounts.append(amount)
+        for date_type in DATES_JSON_LOCATION:
+            date = grant_dates.get(date_type, {})
+            self.dates[date_type].append(date.get("datetime_date"))
+            self.impossible_dates[date_type].append(date.get("date_error") == DateError.OUT_OF_RANGE)
+
+        if len(self.path_prefixes) >= self.chunk_size:
+            self.flush()
+
+    def flush(self):
+        if not self.path_prefixes:
+            return
+
+        # Missing values are NaN/NaT, which are never equal to, greater or less than anything
+        self.amounts = numpy.array(self.amounts, dtype=numpy.float64)
+        for date_type in DATES_JSON_LOCATION:
+            self.dates[date_type] = numpy.array(self.dates[date_type], dtype="datetime64[us]")
+            self.impossible_dates[date_type] = numpy.array(self.impossible_dates[date_type], dtype=bool)
+
+        for test_instance in self.test_instances:
+            if self.timings is not None:
+                self.timings.timed_check(test_instance, test_instance.process_columns)(self)
+            else:
+                test_instance.process_columns(self)
+
+        self.clear()
+
+
+def uses_columns(test_instance):
+    """Whether the test instance can be run by GrantColumns
 
-    test_instances = [test_cls(grants=json_data["grants"], aggregates=aggregates) for test_cls in test_classes]
+    Only if numpy is available and process_columns() is defined alongside process(),
+    so a subclass that overrides process() is run a grant at a time.
+    """
+    if numpy is None:
+        return False
+    for cls in type(test_instance).__mro__:
+        if "process" in vars(cls) or "process_columns" in vars(cls):
+            return "process" in vars(cls) and "process_columns" in vars(cls)
+    return False
+
+
+class CheckTimings(object):
+    """Records the cumulative wall time and number of calls for each check class and
+    stage of the checks, plus the number of grants each check failed.
+
+    Shared values such as GrantFeatures are worked out when first used, so their time
+    counts towards whichever check used them first.
+    """
 
-    for num, grant in enumerate(json_data["grants"]):
+    def __init__(self):
+        self.checks = {}
+        self.stages = {}
+
+    def check(self, test_instance):
+        return self.checks.setdefault(
+            test_instance.__class__.__name__, {"time": 0.0, "calls": 0, "failures": 0}
+        )
+
+    def timed(self, timing, function):
+        """Wrap function to add the time taken and number of calls to timing"""
+        def timed_function(*args):
+            start = time.perf_counter()
+            try:
+                return function(*args)
+            finally:
+                timing["time"] += time.perf_counter() - start
+                timing["calls"] += 1
+
+        return timed_function
+
+    def timed_check(self, test_instance, function):
+        return self.timed(self.check(test_instance), function)
+
+    def timed_stage(self, name, function):
+        return self.timed(self.stages.setdefault(name, {"time": 0.0, "calls": 0}), function)
+
+    @contextlib.contextmanager
+    def stage(self, name):
+        timing = self.stages.setdefault(name, {"time": 0.0, "calls": 0})
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            timing["time"] += time.perf_counter() - start
+            timing["calls"] += 1
+
+    def record_failures(self, test_instances):
         for test_instance in test_instances:
-            test_instance.process(grant, "grants/{}".format(num))
+            self.check(test_instance)["failures"] += test_instance.count
+
+    def as_dict(self):
+        return {"checks": self.checks, "stages": self.stages}
+
+
+def grant_processors(test_instances, timings=None):
+    """Return the process functions for the test instances, taking (grant, path_prefix, features)
 
+    Checks written before process() took the features argument are still supported.
+    Checks that can be are run on columns of values from many grants with GrantColumns,
+    so flush_processors() must be called after the last grant.
+    timings: optional CheckTimings to record the time spent in each check.
+    """
+    processors = []
+    column_instances = []
+    for test_instance in test_instances:
+        if uses_columns(test_instance):
+            column_instances.append(test_instance)
+            continue
+        elif test_instance.process_takes_features:
+            process = test_instance.process
+        else:
+            process = (
+                lambda grant, path_prefix, features, process=test_instance.process: process(grant, path_prefix)
+            )
+        if timings is not None:
+            process = timings.timed_check(test_instance, process)
+        processors.append(process)
+    if column_instances:
+        processors.append(GrantColumns(column_instances, timings))
+    return processors
+
+
+def flush_processors(processors):
+    """Finish processing any grants that grant_processors() processors have held back"""
+    for process in processors:
+        if isinstance(process, GrantColumns):
+            process.flush()
+
+
+# The exceptions which tools.ignore_errors treats as a problem with the data
+# rather than with the code
+DATA_ERRORS = (KeyError, TypeError, IndexError, AttributeError, ValueError)
+
+
+class SpreadsheetLocations(list):
+    """The spreadsheet locations of a check's json locations
+
+    total is the number of locations the check found, as for JsonLocations, which
+    can be more than were kept.
+    """
+
+    def __init__(self, locations=(), total=None):
+        super().__init__(locations)
+        self.total = len(self) if total is None else total
+
+
+def produce_check_results(test_instances, cell_source_map):
+    """Turn the processed test instances into the results list for the context"""
     results = []
 
     for test_instance in test_instances:
@@ -2103,10 +2854,13 @@ def run_extra_checks(json_data, cell_source_map, test_classes, aggregates):
         spreadsheet_keys = ("sheet", "letter", "row_number", "header")
         if cell_source_map:
             try:
-                spreadsheet_locations = [
-                    dict(zip(spreadsheet_keys, cell_source_map[location][0]))
-                    for location in test_instance.json_locations
-                ]
+                spreadsheet_locations = SpreadsheetLocations(
+                    (
+                        dict(zip(spreadsheet_keys, cell_source_map[location][0]))
+                        for location in test_instance.json_locations
+                    ),
+                    total=getattr(test_instance.json_locations, "total", None),
+                )
             except KeyError:
                 logger.warning(f"{test_instance} - Spreadsheet location couldn't be defined {test_instance.json_locations}")
                 pass
@@ -2119,3 +2873,530 @@ def run_extra_checks(json_data, cell_source_map, test_classes, aggregates):
         )
 
     return results
+
+
+class CheckFailures(object):
+    """Which grants failed which checks, from the results of run_checks()
+
+    Each check's JsonLocations keeps a bitset of the grants that failed it, so
+    questions across the checks are answered by combining the bitsets with & and
+    counting bits, without going back over the grants or their json locations.
+    importance limits a question to the checks with at least that importance,
+    e.g. TestImportance.CRITICAL.
+    """
+
+    def __init__(self, results):
+        self.checks = [
+            (message, json_locations.failing_grants.as_int())
+            for message, json_locations, spreadsheet_locations in results or []
+            if isinstance(json_locations, JsonLocations)
+        ]
+
+    def selected(self, importance=None):
+        return [
+            (message, bits) for message, bits in self.checks
+            if importance is None or message["importance"] >= importance
+        ]
+
+    def failure_counts(self, importance=None):
+        """The number of checks each grant failed, as bit planes: bit n of the
+        i-th int is bit i of the number of checks grant n failed"""
+        planes = []
+        for message, bits in self.selected(importance):
+            # Add bits to the counts, carrying as in binary addition
+            carry = bits
+            for plane, counts in enumerate(planes):
+                planes[plane], carry = counts ^ carry, counts & carry
+                if not carry:
+                    break
+            if carry:
+                planes.append(carry)
+        return planes
+
+    def failing_exactly_or_more(self, planes, number):
+        """(grants failing exactly number checks, grants failing more) as ints"""
+        more = 0
+        # Every grant that failed any check
+        exactly = 0
+        for counts in planes:
+            exactly |= counts
+        if number < 1:
+            return 0, exactly
+        if number >> len(planes):
+            return 0, 0
+        for plane in reversed(range(len(planes))):
+            if number >> plane & 1:
+                exactly &= planes[plane]
+            else:
+                more |= exactly & planes[plane]
+                exactly &= ~planes[plane]
+        return exactly, more
+
+    def grants_failing_at_least(self, number, importance=None):
+        """The indexes of the grants that failed at least number checks"""
+        exactly, more = self.failing_exactly_or_more(self.failure_counts(importance), number)
+        return list(iter_bits(exactly | more))
+
+    def co_failure_matrix(self, importance=None):
+        """(messages, matrix) where matrix[i][j] is the number of grants that failed
+        both of the checks in messages[i] and messages[j]"""
+        checks = self.selected(importance)
+        matrix = [[(bits & other).bit_count() for message, other in checks] for message, bits in checks]
+        return [message for message, bits in checks], matrix
+
+    def worst_grants(self, limit=10, importance=None):
+        """Up to limit (grant index, messages of the checks it failed) for the grants
+        that failed the most checks, in order of the number failed then index"""
+        checks = self.selected(importance)
+        planes = self.failure_counts(importance)
+        worst = []
+        for number in reversed(range(1, 1 << len(planes))):
+            exactly, more = self.failing_exactly_or_more(planes, number)
+            for grant_index in iter_bits(exactly):
+                if len(worst) >= limit:
+                    return worst
+                worst.append((grant_index, [message for message, bits in checks if bits >> grant_index & 1]))
+        return worst
+
+
+# How many grants check_grants() gives each test's process_batch() at a time
+PROCESS_BATCH_SIZE = 1000
+
+
+def check_grants(
+    grants,
+    test_instances,
+    aggregator=None,
+    start_index=0,
+    ignore_errors=False,
+    timings=None,
+    plan=False,
+):
+    """Run groups of test instances, and optionally a GrantsAggregator, over grants in one pass
+
+    test_instances: dict of test class type (e.g. TestType.QUALITY_TEST_CLASS) to a
+    list of test instances. The grants are numbered from start_index.
+
+    The grants are processed PROCESS_BATCH_SIZE at a time, with each test's
+    process_batch() given the whole batch, apart from the tests run by GrantColumns,
+    which are given a grant at a time. With timings, a test's calls are the number
+    of batches or grants it was given.
+
+    With plan, a test with required_fields isn't run until a batch has a grant with
+    one of them (see plan_checks()). It can't fail on the grants before that, so its
+    results are the same.
+
+    With ignore_errors a group of tests stops being run when one of them raises one
+    of DATA_ERRORS, as does the aggregator. Returns (whether the aggregator errored,
+    the set of test class types that errored).
+    """
+    aggregate = None
+    if aggregator is not None:
+        aggregate = aggregator.process
+        if timings is not None:
+            aggregate = timings.timed_stage("get_grants_aggregates", aggregate)
+    aggregates_errored = False
+
+    column_processors = {test_class_type: [] for test_class_type in test_instances}
+    batch_processors = {test_class_type: [] for test_class_type in test_instances}
+
+    def start_checks(test_class_type, instances):
+        for test_instance in instances:
+            if uses_columns(test_instance):
+                # The grants before this batch that GrantColumns is holding back don't
+                # have the test's required_fields, so it can be added part way through
+                if column_processors[test_class_type]:
+                    column_processors[test_class_type][0].test_instances.append(test_instance)
+                else:
+                    column_processors[test_class_type].append(GrantColumns([test_instance], timings))
+            else:
+                batch_processors[test_class_type].append(
+                    timings.timed_check(test_instance, test_instance.process_batch)
+                    if timings is not None else test_instance.process_batch
+                )
+
+    pending = {}
+    for test_class_type, instances in test_instances.items():
+        planned_classes = plan_checks([type(test_instance) for test_instance in instances], {}) if plan else None
+        start_checks(
+            test_class_type,
+            [test_instance for test_instance in instances if not plan or type(test_instance) in planned_classes],
+        )
+        pending[test_class_type] = [
+            test_instance for test_instance in instances if plan and type(test_instance) not in planned_classes
+        ]
+    errored_types = set()
+
+    grants = iter(grants)
+    batch_start = start_index
+    while True:
+        batch = list(itertools.islice(grants, PROCESS_BATCH_SIZE))
+        if not batch:
+            break
+        features = [GrantFeatures(grant, num) for num, grant in enumerate(batch, batch_start)]
+        batch_start += len(batch)
+
+        if aggregate is not None and not aggregates_errored:
+            try:
+                for grant in batch:
+                    aggregate(grant)
+            except DATA_ERRORS:
+                if not ignore_errors:
+                    raise
+                aggregates_errored = True
+
+        for test_class_type, instances in pending.items():
+            if not instances or test_class_type in errored_types:
+                continue
+            fields = {field for test_instance in instances for field in test_instance.required_fields}
+            planned_classes = plan_checks(
+                [type(test_instance) for test_instance in instances],
+                dict.fromkeys(fields_present_in(batch, fields), True),
+            )
+            start_checks(
+                test_class_type,
+                [test_instance for test_instance in instances if type(test_instance) in planned_classes],
+            )
+            pending[test_class_type] = [
+                test_instance for test_instance in instances if type(test_instance) not in planned_classes
+            ]
+
+        for test_class_type in test_instances:
+            if test_class_type in errored_types:
+                continue
+            try:
+                for process_batch in batch_processors[test_class_type]:
+                    process_batch(batch, features[0].index, features)
+                type_column_processors = column_processors[test_class_type]
+                if type_column_processors:
+                    for grant, grant_features in zip(batch, features):
+                        for process in type_column_processors:
+                            process(grant, grant_features.path_prefix, grant_features)
+            except DATA_ERRORS:
+                if not ignore_errors:
+                    raise
+                errored_types.add(test_class_type)
+
+    for test_class_type, processors in column_processors.items():
+        if test_class_type in errored_types:
+            continue
+        try:
+            flush_processors(processors)
+        except DATA_ERRORS:
+            if not ignore_errors:
+                raise
+            errored_types.add(test_class_type)
+
+    return aggregates_errored, errored_types
+
+
+def process_grants(test_instances, grants, start_index=0, timings=None):
+    """Run each of the test instances over grants, numbering the grants from start_index
+
+    See check_grants(), which this is for a single group of tests.
+    """
+    check_grants(grants, {None: test_instances}, start_index=start_index, timings=timings)
+
+
+def _check_shard(test_classes, grants, start, test_options, aggregate, ignore_errors, plan):
+    test_instances = {
+        test_class_type: [
+            test_cls(grants=None, aggregates=None, keep_merge_state=True, **test_options) for test_cls in classes
+        ]
+        for test_class_type, classes in test_classes.items()
+    }
+    aggregator = GrantsAggregator() if aggregate else None
+    aggregates_errored, errored_types = check_grants(
+        grants, test_instances, aggregator, start, ignore_errors=ignore_errors, plan=plan
+    )
+    return aggregator, test_instances, aggregates_errored, errored_types
+
+
+def check_grants_in_parallel(
+    grants, test_classes, workers, aggregate=False, ignore_errors=False, test_options=None, plan=False
+):
+    """check_grants() with the grants split into contiguous ranges, each checked in a
+    separate process, and the results merge()d in grant order.
+
+    test_classes: dict of test class type to a list of test classes, which must be
+    importable (i.e. not defined inside a function) so they can be used in the worker
+    processes. grants must be a sequence. Each worker is only sent its own range of
+    the grants, so the data is pickled once in total whatever the start method.
+
+    Returns (the GrantsAggregator if aggregate else None, dict of test class type to the
+    test instances, whether the aggregator errored, the set of test class types that
+    errored). The test instances' aggregates are still to be set.
+    """
+    shard_size = -(-len(grants) // workers)
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = [
+            executor.submit(
+                _check_shard,
+                test_classes,
+                grants[start:start + shard_size],
+                start,
+                test_options or {},
+                aggregate,
+                ignore_errors,
+                plan,
+            )
+            for start in range(0, len(grants), shard_size)
+        ]
+        shards = [future.result() for future in futures]
+
+    aggregator, test_instances, aggregates_errored, errored_types = shards[0]
+    for other_aggregator, other_instances, other_aggregates_errored, other_errored_types in shards[1:]:
+        aggregates_errored = aggregates_errored or other_aggregates_errored
+        errored_types |= other_errored_types
+        if aggregator is not None and not aggregates_errored:
+            aggregator.merge(other_aggregator)
+        for test_class_type, instances in test_instances.items():
+            if test_class_type in errored_types:
+                continue
+            for test_instance, other in zip(instances, other_instances[test_class_type]):
+                test_instance.merge(other)
+
+    for instances in test_instances.values():
+        for test_instance in instances:
+            test_instance.grants = grants
+
+    return aggregator, test_instances, aggregates_errored, errored_types
+
+
+def process_grants_in_parallel(grants, test_classes, aggregates, workers, test_options=None):
+    """Run the test classes over the grants with check_grants_in_parallel() and return
+    the test instances"""
+    _, test_instances, _, _ = check_grants_in_parallel(
+        grants, {None: test_classes}, workers, test_options=test_options
+    )
+    for test_instance in test_instances[None]:
+        test_instance.aggregates = aggregates
+    return test_instances[None]
+
+
+def plan_checks(test_classes, fields_present=None):
+    """Return the test classes that could fail on the data, in order
+
+    A test can't fail when none of its required_fields are in fields_present (from
+    lib360dataquality/coverage.py), e.g. the tests of grants to individuals when no
+    grant has recipientIndividual.
+
+    run_checks does this a batch of grants at a time (see check_grants()), so a test
+    isn't run until the first grant that it could fail on.
+
+    recipient_individuals_count in the aggregates isn't used for this as it doesn't
+    count an empty recipientIndividual, which some of those tests still fail on.
+    """
+    planned = []
+    for test_class in test_classes:
+        if (
+            fields_present is not None
+            and test_class.required_fields
+            and not any(fields_present.get(field) for field in test_class.required_fields)
+        ):
+            continue
+        planned.append(test_class)
+    return planned
+
+
+def grant_has_field(grant, field):
+    """Whether a grant has field, a path from lib360dataquality/coverage.py such as
+    "/grants/recipientOrganization/id"
+
+    As with fields_present there, a key counts whatever its value is, and the dicts in
+    a list are looked in.
+    """
+    values = [grant]
+    for key in field.split("/")[2:]:
+        values = [
+            item[key]
+            for value in values
+            for item in (value if isinstance(value, list) else [value])
+            if isinstance(item, dict) and key in item
+        ]
+        if not values:
+            return False
+    return True
+
+
+def fields_present_in(grants, fields):
+    """The set of fields (see grant_has_field()) that any of the grants have"""
+    return {field for field in fields if any(grant_has_field(grant, field) for grant in grants)}
+
+
+def run_test_options(test_options):
+    """test_options plus the objects shared by all of the tests in a run, unless given
+
+    One ReferenceTime so that all of the date checks use the same time, and one
+    VerdictCache so identifiers in many grants are only classified once.
+    """
+    return {"reference_time": ReferenceTime(), "verdict_cache": VerdictCache(), **(test_options or {})}
+
+
+@tools.ignore_errors
+def run_extra_checks(
+    json_data,
+    cell_source_map,
+    test_classes,
+    aggregates,
+    workers=1,
+    fields_present=None,
+    timings=None,
+    test_options=None,
+):
+    """Run the test classes over json_data["grants"] and return the results of the ones that failed
+
+    workers: if more than 1 the grants are split between that many processes,
+    which is worth it for very large files.
+    fields_present: the result of get_unique_fields_present(json_data) if it is
+    available, lets more of the tests that can't fail be skipped (see plan_checks).
+    timings: optional CheckTimings to record the time spent in each test. Only the
+    number of failures is recorded for the tests when workers is more than 1.
+    test_options: dict of keyword arguments for each of the tests, e.g. max_json_locations
+    """
+    test_options = run_test_options(test_options)
+    if "grants" not in json_data:
+        return []
+
+    grants = json_data["grants"]
+    planned_classes = plan_checks(test_classes, fields_present)
+    if workers > 1 and len(grants) > workers:
+        processed = process_grants_in_parallel(grants, planned_classes, aggregates, workers, test_options)
+    else:
+        processed = [test_cls(grants=grants, aggregates=aggregates, **test_options) for test_cls in planned_classes]
+        process_grants(processed, grants, timings=timings)
+
+    # Tests that were skipped still get finalized, the same as a test that passed
+    processed = iter(processed)
+    test_instances = [
+        next(processed) if test_cls in planned_classes else test_cls(grants=grants, aggregates=aggregates, **test_options)
+        for test_cls in test_classes
+    ]
+
+    for test_instance in test_instances:
+        test_instance.finalize()
+
+    if timings is not None:
+        timings.record_failures(test_instances)
+
+    return produce_check_results(test_instances, cell_source_map)
+
+
+def run_checks(
+    json_data,
+    cell_source_map,
+    test_classes,
+    ignore_errors=False,
+    timings=None,
+    test_options=None,
+    workers=1,
+):
+    """Run the grants aggregates and several groups of additional checks in a single
+    pass over the grants.
+
+    test_classes: dict of test class type (e.g. TestType.QUALITY_TEST_CLASS) to a list
+    of AdditionalTest classes.
+
+    Returns a tuple of the grants aggregates and a dict of test class type to the
+    results of that group of checks (the same as run_extra_checks would return).
+
+    With ignore_errors each group fails independently as it would with separate
+    get_grants_aggregates/run_extra_checks calls: the aggregates become {} and the
+    results for a group of checks become None.
+
+    timings: optional CheckTimings to record the time spent in each check, and in
+    working out the aggregates as the get_grants_aggregates stage.
+    test_options: dict of keyword arguments for each of the tests, e.g. max_json_locations
+    workers: if more than 1 the grants are split between that many processes, see
+    run_checks_over_grants
+    """
+    try:
+        grants = json_data["grants"] if "grants" in json_data else []
+    except DATA_ERRORS:
+        if not ignore_errors:
+            raise
+        return {}, {test_class_type: None for test_class_type in test_classes}
+
+    return run_checks_over_grants(
+        grants, cell_source_map, test_classes, ignore_errors, timings, test_options, workers
+    )
+
+
+def run_checks_over_grants(
+    grants,
+    cell_source_map,
+    test_classes,
+    ignore_errors=False,
+    timings=None,
+    test_options=None,
+    workers=1,
+):
+    """run_checks for any iterable of grants, e.g. a generator reading them from a file
+
+    workers: if more than 1 and grants is a list, the grants are split between that
+    many processes, which is worth it for very large files. The test classes must be
+    importable, and only the number of failures is recorded in timings for the checks.
+    """
+    test_options = run_test_options(test_options)
+    if workers > 1 and isinstance(grants, list) and len(grants) > workers:
+        aggregator, test_instances, aggregates_errored, errored_types = check_grants_in_parallel(
+            grants, test_classes, workers, aggregate=True, ignore_errors=ignore_errors, test_options=test_options,
+            plan=True,
+        )
+        return finish_checks(
+            cell_source_map, aggregator, test_instances, aggregates_errored, errored_types, ignore_errors, timings
+        )
+
+    aggregator = GrantsAggregator()
+    test_instances = {
+        test_class_type: [test_cls(grants=grants, aggregates=None, **test_options) for test_cls in classes]
+        for test_class_type, classes in test_classes.items()
+    }
+    aggregates_errored, errored_types = check_grants(
+        grants,
+        test_instances,
+        aggregator,
+        ignore_errors=ignore_errors,
+        timings=timings,
+        plan=True,
+    )
+    return finish_checks(
+        cell_source_map, aggregator, test_instances, aggregates_errored, errored_types, ignore_errors, timings
+    )
+
+
+def finish_checks(
+    cell_source_map, aggregator, test_instances, aggregates_errored, errored_types, ignore_errors, timings
+):
+    """Produce the aggregates and finalize the test instances once check_grants() has
+    run them over all of the grants, returning what run_checks_over_grants does"""
+    produce_aggregates = aggregator.produce_aggregates
+    if timings is not None:
+        produce_aggregates = timings.timed_stage("get_grants_aggregates", produce_aggregates)
+    aggregates = {}
+    if not aggregates_errored:
+        try:
+            aggregates = produce_aggregates()
+        except DATA_ERRORS:
+            if not ignore_errors:
+                raise
+
+    results = {}
+    for test_class_type, instances in test_instances.items():
+        if test_class_type in errored_types:
+            results[test_class_type] = None
+            continue
+
+        try:
+            for test_instance in instances:
+                test_instance.aggregates = aggregates
+                test_instance.finalize()
+            if timings is not None:
+                timings.record_failures(instances)
+            results[test_class_type] = produce_check_results(instances, cell_source_map)
+        except DATA_ERRORS:
+            if not ignore_errors:
+                raise
+            results[test_class_type] = None
+
+    return aggregates, results
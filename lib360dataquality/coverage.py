@@ -8,10 +8,13 @@ def _unique_fields_present_generator(json_data):
     if 'grants' not in json_data:
         return
     for grant in json_data['grants']:
-        # Flatten the key,val pairs so we can make a unique list of fields
-        field_list = [field for field, value in fields_present_generator(grant)]
-        for field in set(field_list):
-            yield '/grants' + field
+        yield from grant_unique_fields_present(grant)
+
+
+def grant_unique_fields_present(grant):
+    # Flatten the key,val pairs so we can make a unique list of fields
+    field_list = [field for field, value in fields_present_generator(grant)]
+    return ['/grants' + field for field in set(field_list)]
 
 
 def get_unique_fields_present(*args, **kwargs):
@@ -0,0 +1,177 @@
+import hashlib
+import math
+from array import array
+
+try:
+    import numpy
+except ImportError:
+    # Without numpy (see the perf extra in setup.py) the hashes are sorted as Python ints
+    numpy = None
+
+
+def hash64(value):
+    """A 64 bit hash of value that is the same in every process (unlike hash())"""
+    text = value if isinstance(value, str) else repr(value)
+    return int.from_bytes(hashlib.blake2b(text.encode("utf-8", "surrogatepass"), digest_size=8).digest(), "little")
+
+
+class HyperLogLog(object):
+    """An estimate of the number of distinct values added, in a fixed amount of memory
+
+    Uses 2 ** precision bytes (16KB by default) however many values are added. The
+    estimate has a relative standard error of relative_error (0.81% by default), i.e.
+    about two thirds of estimates are within that of the true count and nearly all
+    within three times it. Counts up to about 2 ** precision are close to exact.
+
+    Can be used like a set of the values for add() and len(). Sketches with the same
+    precision can be combined with merge(), the same as adding all of the values to one.
+    """
+
+    def __init__(self, precision=14):
+        self.precision = precision
+        self.registers = bytearray(1 << precision)
+        self.rest_bits = 64 - precision
+
+    @property
+    def relative_error(self):
+        return 1.04 / math.sqrt(len(self.registers))
+
+    def add(self, value):
+        self.add_hash(hash64(value))
+
+    def add_hash(self, hashed):
+        """add() a value given its hash64()"""
+        register = hashed >> self.rest_bits
+        # The position of the first 1 in the rest of the bits
+        rank = self.rest_bits - (hashed & ((1 << self.rest_bits) - 1)).bit_length() + 1
+        if rank > self.registers[register]:
+            self.registers[register] = rank
+
+    def merge(self, other):
+        if other.precision != self.precision:
+            raise ValueError("Can't merge HyperLogLogs with different precisions")
+        self.registers = bytearray(map(max, self.registers, other.registers))
+
+    def __len__(self):
+        size = len(self.registers)
+        estimate = (0.7213 / (1 + 1.079 / size)) * size * size / sum(2.0 ** -rank for rank in self.registers)
+        empty = self.registers.count(0)
+        if estimate <= 2.5 * size and empty:
+            # Linear counting is more accurate for small counts
+            estimate = size * math.log(size / empty)
+        return round(estimate)
+
+    def __repr__(self):
+        return "HyperLogLog(~{})".format(len(self))
+
+
+class IdHashes(object):
+    """The 64 bit hash of each id added, to find repeated ids in 8 bytes per id
+
+    Two different ids only have the same hash with a chance of about n ** 2 / 2 ** 65
+    for n ids, e.g. 1 in 370,000 for 10 million ids.
+    """
+
+    def __init__(self):
+        self.hashes = array("Q")
+
+    def add(self, value):
+        self.hashes.append(hash64(value))
+
+    def add_hash(self, hashed):
+        """add() a value given its hash64()"""
+        self.hashes.append(hashed)
+
+    def merge(self, other):
+        self.hashes.extend(other.hashes)
+
+    def repeated(self):
+        """The hashes that were added more than once"""
+        if numpy is not None:
+            hashes = numpy.sort(numpy.frombuffer(self.hashes, dtype=numpy.uint64))
+            return set(hashes[1:][hashes[1:] == hashes[:-1]].tolist())
+        repeated = set()
+        previous = None
+        for hashed in sorted(self.hashes):
+            if hashed == previous:
+                repeated.add(hashed)
+            previous = hashed
+        return repeated
+
+
+class QuantileSketch(object):
+    """Estimates of the quantiles (e.g. the median) of the numbers added, without
+    keeping the numbers
+
+    Numbers are counted in buckets whose bounds grow geometrically (as in DDSketch),
+    so every quantile is within relative_accuracy (1% by default) of the true value
+    and memory depends on the range of the numbers rather than how many there are,
+    e.g. about 1,000 buckets for amounts from 1 to 1,000,000,000.
+
+    Sketches with the same relative_accuracy can be combined with merge(), which
+    gives exactly the same sketch as adding all of the numbers to one.
+    """
+
+    def __init__(self, relative_accuracy=0.01):
+        self.relative_accuracy = relative_accuracy
+        self.gamma = (1 + relative_accuracy) / (1 - relative_accuracy)
+        self.log_gamma = math.log(self.gamma)
+        self.count = 0
+        self.zero_count = 0
+        # Bucket index to the number of numbers in it, for positive numbers and
+        # for the absolute values of the negative ones
+        self.positive = {}
+        self.negative = {}
+
+    def add(self, value):
+        try:
+            value = float(value)
+        except OverflowError:
+            return
+        if not math.isfinite(value):
+            # Infinite or NaN, there are no buckets for these
+            return
+        self.count += 1
+        if value > 0:
+            buckets = self.positive
+        elif value < 0:
+            buckets = self.negative
+            value = -value
+        else:
+            self.zero_count += 1
+            return
+        index = math.ceil(math.log(value) / self.log_gamma)
+        buckets[index] = buckets.get(index, 0) + 1
+
+    def merge(self, other):
+        if other.relative_accuracy != self.relative_accuracy:
+            raise ValueError("Can't merge QuantileSketches with different relative accuracies")
+        self.count += other.count
+        self.zero_count += other.zero_count
+        for buckets, other_buckets in [(self.positive, other.positive), (self.negative, other.negative)]:
+            for index, count in other_buckets.items():
+                buckets[index] = buckets.get(index, 0) + count
+
+    def bucket_value(self, index):
+        # The value in the bucket with the least relative error to all of the bucket
+        return 2 * self.gamma ** index / (self.gamma + 1)
+
+    def quantile(self, quantile):
+        """An estimate of the number at position quantile * (count - 1) of the sorted
+        numbers, e.g. quantile(0.5) is the median. None if there are no numbers."""
+        if not self.count:
+            return None
+        rank = quantile * (self.count - 1)
+        seen = 0
+        for index in sorted(self.negative, reverse=True):
+            seen += self.negative[index]
+            if seen > rank:
+                return -self.bucket_value(index)
+        seen += self.zero_count
+        if seen > rank:
+            return 0.0
+        for index in sorted(self.positive):
+            seen += self.positive[index]
+            if seen > rank:
+                return self.bucket_value(index)
+        return self.bucket_value(max(self.positive))
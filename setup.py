@@ -14,13 +14,14 @@ setup(
         'libcove>=0.18.0',
         'python-dateutil',
         'rangedict',
-        'ijson',
+        'ijson>=3.1',
         'jsonschema<4',
         'json-merge-patch',
     ],
     extras_require={
         'perf': [
             'orjson>=3',
+            'numpy',
         ],
         'test': [
             'coveralls',
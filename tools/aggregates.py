@@ -1,6 +1,10 @@
 #!/usr/bin/env python3
 import json
-from lib360dataquality.cove.threesixtygiving import get_grants_aggregates
+
+import ijson
+from lib360dataquality.cove.threesixtygiving import (
+    GrantsAggregator, DATA_ERRORS, get_grants_aggregates_from_file
+)
 
 
 def replace_none_keys(nested_data):
@@ -22,30 +26,48 @@ def replace_none_keys(nested_data):
             replace_none_keys(item)
 
 
+def sets_to_counts(aggregates):
+    # replace sets with counts
+    for k, v in list(aggregates.items()):
+        if isinstance(v, set):
+            aggregates[k + "_count"] = len(v)
+            if k == "distinct_funding_org_identifier":
+                aggregates[k] = sorted(list(aggregates[k]))
+            else:
+                del aggregates[k]
+    return {
+        k: sorted(list(v)) if isinstance(v, set) else v
+        for k, v in aggregates.items()
+    }
+
+
 data_all = json.load(open("data/data_all.json"))
 stats = []
+# The aggregates across all of the datasets, e.g. finding grant ids used in more than one.
+# The distinct ids are counted approximately so that it fits in memory for millions of grants
+corpus_aggregator = GrantsAggregator(approximate_distinct=True)
 
 for dataset in data_all:
     json_filename = "data/json_all/%s.json" % dataset["identifier"]
 
     # Check that we had a location where json_filename file downloaded to
     if dataset["datagetter_metadata"].get("json") and dataset["datagetter_metadata"]["valid"]:
-        with open(json_filename) as fp:
-            aggregates = get_grants_aggregates(json.load(fp))
-        # replace sets with counts
-        for k, v in list(aggregates.items()):
-            if isinstance(v, set):
-                aggregates[k + "_count"] = len(v)
-                if k == "distinct_funding_org_identifier":
-                    aggregates[k] = sorted(list(aggregates[k]))
-                else:
-                    del aggregates[k]
-        aggregates = {
-            k: sorted(list(v)) if isinstance(v, set) else v
-            for k, v in aggregates.items()
-        }
+        # Read the grants one at a time, so the largest files fit in memory
+        aggregator = GrantsAggregator()
+        try:
+            aggregates = get_grants_aggregates_from_file(json_filename, use_float=True, aggregator=aggregator)
+        except (ijson.JSONError, *DATA_ERRORS):
+            aggregates = {}
+        else:
+            corpus_aggregator.merge(aggregator)
+        aggregates = sets_to_counts(aggregates)
         dataset["datagetter_aggregates"] = aggregates
     replace_none_keys(dataset)
     stats.append(dataset)
     with open("data/status.json", "w") as fp:
         json.dump(stats, fp, indent="  ", sort_keys=True)
+
+corpus_aggregates = sets_to_counts(corpus_aggregator.produce_aggregates())
+replace_none_keys(corpus_aggregates)
+with open("data/aggregates_all.json", "w") as fp:
+    json.dump(corpus_aggregates, fp, indent="  ", sort_keys=True)
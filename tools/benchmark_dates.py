@@ -0,0 +1,65 @@
+#!/usr/bin/env python3
+"""Time reading the grant dates, compared with using datetime.strptime for each date
+
+Usage: python benchmark_dates.py [number of grants]
+"""
+import datetime
+import random
+import sys
+import timeit
+
+from lib360dataquality.cove.threesixtygiving import create_grant_dates_dict
+
+
+def strptime_grant_dates(grant):
+    """How the grant dates were read before, for comparison"""
+    grant_dates = {}
+    for date_type, input_date in [
+        ["award_date", grant.get("awardDate")],
+        ["planned_start_date", grant["plannedDates"][0].get("startDate")],
+        ["planned_end_date", grant["plannedDates"][0].get("endDate")],
+        ["actual_start_date", grant["actualDates"][0].get("startDate")],
+        ["actual_end_date", grant["actualDates"][0].get("endDate")],
+    ]:
+        try:
+            datetime_date = datetime.datetime.strptime(input_date.split("T")[0], "%Y-%m-%d")
+            error_msg = None
+        except ValueError as e:
+            datetime_date = None
+            error_msg = str(e)
+        grant_dates[date_type] = {"datetime_date": datetime_date, "date_format_error": error_msg}
+    return grant_dates
+
+
+def random_date(rng):
+    date = "{:04}-{:02}-{:02}".format(rng.randint(1990, 2030), rng.randint(1, 12), rng.randint(1, 31))
+    choice = rng.random()
+    if choice < 0.2:
+        return date + "T00:00:00+00:00"
+    if choice < 0.22:
+        return date.replace("-", "/")
+    return date
+
+
+def main():
+    number_of_grants = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    rng = random.Random(0)
+    grants = [
+        {
+            "awardDate": random_date(rng),
+            "plannedDates": [{"startDate": random_date(rng), "endDate": random_date(rng)}],
+            "actualDates": [{"startDate": random_date(rng), "endDate": random_date(rng)}],
+        }
+        for _ in range(number_of_grants)
+    ]
+
+    for name, function in [
+        ("strptime", strptime_grant_dates),
+        ("create_grant_dates_dict", create_grant_dates_dict),
+    ]:
+        seconds = min(timeit.repeat(lambda: [function(grant) for grant in grants], number=1, repeat=3))
+        print("{:<25} {:.3f}s for {} grants".format(name, seconds, number_of_grants))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,13 +1,15 @@
 #!/usr/bin/env python3
 import os
 import argparse
+import datetime
 import json
 import pprint
 
 from lib360dataquality.cove.threesixtygiving import (
     common_checks_360,
+    stream_checks_360,
 )
-from lib360dataquality.additional_test import TestType
+from lib360dataquality.additional_test import ReferenceTime, TestType
 from lib360dataquality.cove.settings import COVE_CONFIG
 from lib360dataquality.cove.schema import Schema360
 
@@ -41,6 +43,36 @@ def main():
         help="Only run data quality checks",
         default=False,
     )
+    parser.add_argument(
+        "--stream",
+        dest="stream",
+        action="store_true",
+        help="Read the grants one at a time for JSON files too large to load into memory. Only runs the additional checks, aggregates and field coverage.",
+        default=False,
+    )
+    parser.add_argument(
+        "--timings",
+        dest="timings",
+        action="store_true",
+        help="Print the time spent in each check and stage instead of the results",
+        default=False,
+    )
+    parser.add_argument(
+        "--as-of",
+        dest="as_of",
+        action="store",
+        type=datetime.datetime.fromisoformat,
+        help="Check the dates as of this time (YYYY-MM-DD[THH:MM:SS]) rather than now, e.g. for old data",
+        default=None,
+    )
+    parser.add_argument(
+        "--workers",
+        dest="workers",
+        action="store",
+        type=int,
+        help="Split the additional checks between this many processes, for large files. Not used with --stream.",
+        default=1,
+    )
 
     args = parser.parse_args()
 
@@ -53,6 +85,26 @@ def main():
     if not file_type:
         file_type = os.path.splitext(file_path)[1][1:].lower()
 
+    if args.usefulness_only and not args.quality_only:
+        test_classes = [TestType.USEFULNESS_TEST_CLASS]
+    elif args.quality_only and not args.usefulness_only:
+        test_classes = [TestType.QUALITY_TEST_CLASS]
+    else:
+        test_classes = None
+
+    test_options = {"reference_time": ReferenceTime(args.as_of)}
+
+    if args.stream and file_type == "json":
+        with open(file_path, "rb") as fp_data:
+            context = stream_checks_360(
+                fp_data, test_classes=test_classes, timings=args.timings, test_options=test_options
+            )
+        if args.timings:
+            print_timings(context["timings"])
+        else:
+            pprint.pprint(context)
+        return
+
     context = {"file_type": file_type}
 
     # We will need to convert it from a spreadsheet format first
@@ -76,24 +128,20 @@ def main():
         with open(file_path, "r") as fp_data:
             data = json.load(fp_data)
 
-    if args.usefulness_only and not args.quality_only:
-        common_checks_360(
-            context,
-            working_dir,
-            data,
-            schema,
-            test_classes=[TestType.USEFULNESS_TEST_CLASS],
-        )
-    elif args.quality_only and not args.usefulness_only:
-        common_checks_360(
-            context,
-            working_dir,
-            data,
-            schema,
-            test_classes=[TestType.QUALITY_TEST_CLASS],
-        )
-    else:
-        common_checks_360(context, working_dir, data, schema)
+    common_checks_360(
+        context,
+        working_dir,
+        data,
+        schema,
+        test_classes=test_classes,
+        timings=args.timings,
+        test_options=test_options,
+        workers=args.workers,
+    )
+
+    if args.timings:
+        print_timings(context["timings"])
+        return
 
     # We don't actually want to show the json data again
     del context["json_data"]
@@ -101,5 +149,15 @@ def main():
     pprint.pprint(context)
 
 
+def print_timings(timings):
+    print("{:<50} {:>10} {:>10}".format("Stage", "Seconds", "Calls"))
+    for name, timing in timings["stages"].items():
+        print("{:<50} {:>10.3f} {:>10}".format(name, timing["time"], timing["calls"]))
+    print()
+    print("{:<50} {:>10} {:>10} {:>10}".format("Check", "Seconds", "Calls", "Failures"))
+    for name, timing in sorted(timings["checks"].items(), key=lambda item: item[1]["time"], reverse=True):
+        print("{:<50} {:>10.3f} {:>10} {:>10}".format(name, timing["time"], timing["calls"], timing["failures"]))
+
+
 if __name__ == "__main__":
     main()
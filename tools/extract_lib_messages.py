@@ -10,6 +10,7 @@ def run_check(check):
         grants={"grants": []}, aggregates={"count": 2, "recipient_individuals_count": 0}
     )
     test.process(grant={"id": "moo"}, path_prefix="/")
+    test.finalize()
     test.count = 2
     test.grants_percentage = 0.5
 